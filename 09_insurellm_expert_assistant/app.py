@@ -1,10 +1,14 @@
 import gradio as gr
 from dotenv import load_dotenv
 
-from implementation.answer import answer_question
+from implementation.answer import load_indexes
+from implementation.async_answer import MAX_CONCURRENT_ANSWERS, MAX_QUEUED_ANSWERS, Overloaded, astream_answer
+from implementation.tracing import Trace
 
 load_dotenv(override=True)
 
+SHOW_TIMINGS = True  # show a per-stage timing breakdown of each answer under the retrieved context
+
 
 def format_context(context):
     """Render the retrieved chunks as HTML for display in the "Retrieved Context" panel."""
@@ -15,13 +19,30 @@ def format_context(context):
     return result
 
 
-def chat(history):
-    """Gradio callback: answer the latest user message using the full conversation as history, and update the UI."""
+def format_timings(trace):
+    """Render a trace's stage timings as markdown for the "Timings" panel."""
+    return "<h2 style='color: #ff7800;'>Timings</h2>\n\n" + trace.breakdown()
+
+
+async def chat(history):
+    """
+    Gradio callback: answer the latest user message using the full conversation as history, streaming the
+    answer into the chat and showing the retrieved context as soon as retrieval finishes. The stage timings
+    are shown once the answer is complete. Sessions are served concurrently on the event loop.
+    """
     last_message = history[-1]["content"]
     prior = history[:-1]
-    answer, context = answer_question(last_message, prior)
-    history.append({"role": "assistant", "content": answer})
-    return history, format_context(context)
+    history.append({"role": "assistant", "content": ""})
+    trace = Trace("chat")
+    context_shown = False
+    try:
+        async for answer, context in astream_answer(last_message, prior, trace):
+            history[-1]["content"] = answer
+            yield history, gr.update() if context_shown else format_context(context), gr.update()
+            context_shown = True
+    except Overloaded:
+        raise gr.Error("The assistant is busy right now, please try again in a moment.")
+    yield history, gr.update(), format_timings(trace) if SHOW_TIMINGS else gr.update()
 
 
 def main():
@@ -52,12 +73,16 @@ def main():
                     container=True,
                     height=600,
                 )
+                timings_markdown = gr.Markdown(visible=SHOW_TIMINGS)
 
-        # On submit: first show the user's message immediately, then run the (slower) RAG answer generation.
+        # On submit: first show the user's message immediately, then stream the (slower) RAG answer.
         message.submit(
             put_message_in_chatbot, inputs=[message, chatbot], outputs=[message, chatbot]
-        ).then(chat, inputs=chatbot, outputs=[chatbot, context_markdown])
+        ).then(chat, inputs=chatbot, outputs=[chatbot, context_markdown, timings_markdown])
 
+    # Up to MAX_CONCURRENT_ANSWERS sessions are answered at once, with a bounded queue behind them.
+    ui.queue(default_concurrency_limit=MAX_CONCURRENT_ANSWERS, max_size=MAX_QUEUED_ANSWERS)
+    load_indexes()  # before the first chat, rather than during it
     ui.launch(inbrowser=True)
 
 
@@ -1,16 +1,43 @@
 import sys
 import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from pydantic import BaseModel, Field
 from litellm import completion
+from tenacity import retry, stop_after_delay
 from dotenv import load_dotenv
 
 from evaluation.test import TestQuestion, load_tests
-from implementation.answer import answer_question, fetch_context
+import implementation.answer as answer
+from implementation import tracing
+from implementation.answer import (
+    FINAL_K,
+    RERANKERS,
+    answer_from_context,
+    confidence,
+    fetch_candidates,
+    fetch_context,
+    fetch_context_unranked,
+    select_chunks,
+    winner_first,
+)
 
 
 load_dotenv(override=True)
 
 MODEL = "gpt-4.1-nano"  # LLM-as-a-judge model used to score generated answers
+# Fast path calibration: threshold grid to search, and the largest drop in mean MRR (vs. always taking
+# the full pipeline) accepted for the recommended thresholds.
+CALIBRATION_SCORES = [0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8]
+CALIBRATION_MARGINS = [0.0, 0.02, 0.05, 0.1]
+CALIBRATION_TOLERANCE = 0.01
+# Parallel runner for the full test set: tests evaluated at once, and the time a single test may take
+# before it is reported as failed. A timed-out test's thread is left to finish in the background and a new
+# one takes its place; once EVAL_CONCURRENCY tests are stuck like this, the remaining tests are failed.
+EVAL_CONCURRENCY = 8
+TEST_TIMEOUT = 300  # seconds
 db_name = "vector_db"
 
 
@@ -41,6 +68,44 @@ class AnswerEval(BaseModel):
     )
 
 
+class EvaluationSession:
+    """
+    Retrieval shared by the retrieval and answer evaluations: each test question's context is fetched once
+    (even when both evaluations run at the same time) and reused by both, so the two metrics describe the
+    same retrieval and its rewrite, embedding and rerank calls are paid once. Contexts are dropped when
+    ingest rebuilds the vector store.
+    """
+
+    def __init__(self):
+        self.contexts = {}
+        self.lock = threading.Lock()
+        self.store_version = None
+
+    def context(self, test: TestQuestion) -> list:
+        """The retrieved chunks for a test, fetching them on first request."""
+        manifest = answer.MANIFEST_PATH
+        version = manifest.stat().st_mtime_ns if manifest.exists() else None
+        with self.lock:
+            if version != self.store_version:
+                self.contexts.clear()
+                self.store_version = version
+            future = self.contexts.get(test.question)
+            fetch = future is None
+            if fetch:
+                future = self.contexts[test.question] = Future()
+        if fetch:
+            try:
+                future.set_result(fetch_context(test.question))
+            except Exception as e:
+                with self.lock:
+                    self.contexts.pop(test.question, None)  # let a later request try again
+                future.set_exception(e)
+        return future.result()
+
+
+session = EvaluationSession()
+
+
 def calculate_mrr(keyword: str, retrieved_docs: list) -> float:
     """Calculate reciprocal rank for a single keyword (case-insensitive).
 
@@ -91,9 +156,13 @@ def evaluate_retrieval(test: TestQuestion, k: int = 10) -> RetrievalEval:
     Returns:
         RetrievalEval object with MRR, nDCG, and keyword coverage metrics
     """
-    # Retrieve documents using shared answer module
-    retrieved_docs = fetch_context(test.question)
+    # Retrieve documents using shared answer module (once per test, shared with evaluate_answer)
+    retrieved_docs = session.context(test)
+    return score_retrieval(test, retrieved_docs, k)
+
 
+def score_retrieval(test: TestQuestion, retrieved_docs: list, k: int = 10) -> RetrievalEval:
+    """Compute the retrieval metrics for chunks already retrieved for a test question."""
     # Calculate MRR (average across all keywords)
     mrr_scores = [calculate_mrr(keyword, retrieved_docs) for keyword in test.keywords]
     avg_mrr = sum(mrr_scores) / len(mrr_scores) if mrr_scores else 0.0
@@ -126,8 +195,8 @@ def evaluate_answer(test: TestQuestion) -> tuple[AnswerEval, str, list]:
     Returns:
         Tuple of (AnswerEval object, generated_answer string, retrieved_docs list)
     """
-    # Get RAG response using shared answer module
-    generated_answer, retrieved_docs = answer_question(test.question)
+    # Get RAG response using shared answer module, from the same retrieval as evaluate_retrieval
+    generated_answer, retrieved_docs = answer_from_context(test.question, [], session.context(test))
 
     # LLM judge prompt
     judge_messages = [
@@ -155,32 +224,173 @@ Provide detailed feedback and scores from 1 (very poor) to 5 (ideal) for each di
         },
     ]
 
-    # Call LLM judge with structured outputs (async)
-    judge_response = completion(model=MODEL, messages=judge_messages, response_format=AnswerEval)
-
-    answer_eval = AnswerEval.model_validate_json(judge_response.choices[0].message.content)
+    # Call LLM judge with structured outputs
+    answer_eval = judge(judge_messages)
 
     return answer_eval, generated_answer, retrieved_docs
 
 
+@retry(wait=answer.wait, stop=stop_after_delay(TEST_TIMEOUT), reraise=True, before_sleep=tracing.count_retry)
+def judge(messages) -> AnswerEval:
+    """Score a generated answer with the judge model, retrying failed calls for up to TEST_TIMEOUT."""
+    response = completion(model=MODEL, messages=messages, response_format=AnswerEval)
+    return AnswerEval.model_validate_json(response.choices[0].message.content)
+
+
+def run_parallel(evaluate, tests):
+    """
+    Run `evaluate` on every test, EVAL_CONCURRENCY at a time, yielding (test, result, progress) as each one
+    completes. A test that raises, or runs longer than TEST_TIMEOUT, is reported and left out of the results
+    instead of stopping the run; progress counts every finished test. Tests run in daemon threads, so a test
+    stuck retrying an unavailable API neither holds a worker nor keeps the process from exiting.
+    """
+    queued = list(range(len(tests)))
+    futures = {}
+    started = {}
+    pending = set()
+    stuck = set()  # timed-out tests whose threads are still running
+    finished = 0
+    failures = []
+
+    def start(index):
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(evaluate(tests[index]))
+            except Exception as e:
+                future.set_exception(e)
+
+        futures[future] = index
+        started[index] = time.monotonic()
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    try:
+        while queued or pending:
+            stuck = {future for future in stuck if not future.done()}
+            if len(stuck) >= EVAL_CONCURRENCY:
+                print(f"{len(stuck)} tests are stuck; failing the {len(queued)} tests not yet started")
+                finished += len(queued)
+                failures.extend(queued)
+                queued = []
+            while queued and len(pending) < EVAL_CONCURRENCY:
+                pending.add(start(queued.pop(0)))
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                finished += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures.append(index)
+                    print(f"Test #{index} failed: {e!r}")
+                    continue
+                yield tests[index], result, finished / len(tests)
+            now = time.monotonic()
+            for future in list(pending):
+                index = futures[future]
+                if now - started[index] > TEST_TIMEOUT:
+                    pending.discard(future)
+                    stuck.add(future)
+                    finished += 1
+                    failures.append(index)
+                    print(f"Test #{index} timed out after {TEST_TIMEOUT}s")
+    finally:
+        if failures:
+            print(f"{len(failures)} of {len(tests)} tests failed and were left out: {sorted(failures)}")
+
+
 def evaluate_all_retrieval():
-    """Evaluate all retrieval tests."""
-    tests = load_tests()
-    total_tests = len(tests)
-    for index, test in enumerate(tests):
-        result = evaluate_retrieval(test)
-        progress = (index + 1) / total_tests
-        yield test, result, progress
+    """Evaluate all retrieval tests in parallel, yielding results as they complete."""
+    yield from run_parallel(evaluate_retrieval, load_tests())
 
 
 def evaluate_all_answers():
-    """Evaluate all answers to tests using batched async execution."""
+    """Evaluate all answers to tests in parallel, yielding results as they complete."""
+    yield from run_parallel(lambda test: evaluate_answer(test)[0], load_tests())
+
+
+def compare_rerankers(k: int = 10):
+    """
+    Report mean MRR, nDCG, keyword coverage and rerank latency for every reranker backend over all tests.
+    Candidates are retrieved once per test and shared, so only the reranking differs between backends.
+    """
     tests = load_tests()
-    total_tests = len(tests)
-    for index, test in enumerate(tests):
-        result = evaluate_answer(test)[0]
-        progress = (index + 1) / total_tests
-        yield test, result, progress
+    candidates = [fetch_candidates(test.question)[0] for test in tests]
+    print(f"{'Reranker':<14} {'MRR':>7} {'nDCG':>7} {'Coverage':>9} {'Latency':>12}")
+    for name, rank_chunks in RERANKERS.items():
+        results = []
+        seconds = 0.0
+        try:
+            for test, chunks in zip(tests, candidates):
+                start = time.perf_counter()
+                order = rank_chunks(test.question, chunks)
+                seconds += time.perf_counter() - start
+                reranked = [chunks[i - 1] for i in order][:FINAL_K]
+                results.append(score_retrieval(test, reranked, k))
+        except ImportError as e:
+            print(f"{name:<14} skipped ({e})")
+            continue
+        mrr = sum(result.mrr for result in results) / len(results)
+        ndcg = sum(result.ndcg for result in results) / len(results)
+        coverage = sum(result.keyword_coverage for result in results) / len(results)
+        latency = seconds / len(results) * 1000
+        marker = " *" if name == answer.RERANKER else ""
+        print(f"{name:<14} {mrr:>7.4f} {ndcg:>7.4f} {coverage:>8.1f}% {latency:>9.1f} ms{marker}")
+
+
+def calibrate_fast_path(k: int = 10):
+    """
+    Calibrate the fast path on all tests. Each test is retrieved three ways: the full pipeline; both
+    searches' candidates with the top-scoring chunk first (no rerank); and the first search alone with the
+    top-scoring chunk first (no rewrite or rerank). For every threshold pair the fast-path rate and the mean MRR of taking each
+    variant of the fast path wherever the thresholds allow are reported.
+    """
+    tests = load_tests()
+    fast_path, answer.FAST_PATH = answer.FAST_PATH, False
+    try:
+        rows = []
+        for test in tests:
+            unranked = fetch_context_unranked(test.question)
+            candidates, _ = fetch_candidates(test.question)
+            skip_rerank = score_retrieval(test, select_chunks(winner_first(candidates)), k)
+            skip_both = score_retrieval(test, select_chunks(winner_first(unranked)), k)
+            full = score_retrieval(test, fetch_context(test.question), k)
+            rows.append((test.category, *confidence(unranked), skip_rerank.mrr, skip_both.mrr, full.mrr))
+    finally:
+        answer.FAST_PATH = fast_path
+    full_mrr = sum(row[5] for row in rows) / len(rows)
+    print(f"Full pipeline MRR {full_mrr:.4f} over {len(rows)} tests")
+    print(
+        f"{'Score':>6} {'Margin':>7} {'Fast path':>10} {'MRR':>7} {'+rewrite':>9}   "
+        "Fast path rate by category (MRR skipping the rerank, then also the rewrite)"
+    )
+    categories = defaultdict(list)
+    for index, row in enumerate(rows):
+        categories[row[0]].append(index)
+    best = None
+    for score in CALIBRATION_SCORES:
+        for margin in CALIBRATION_MARGINS:
+            taken = [row[1] >= score and row[2] >= margin for row in rows]
+            mrr = sum(row[3] if fast else row[5] for row, fast in zip(rows, taken)) / len(rows)
+            mrr_both = sum(row[4] if fast else row[5] for row, fast in zip(rows, taken)) / len(rows)
+            rate = sum(taken) / len(rows)
+            by_category = ", ".join(
+                f"{category} {sum(taken[i] for i in indices) / len(indices):.0%}"
+                for category, indices in sorted(categories.items())
+            )
+            print(f"{score:>6.2f} {margin:>7.2f} {rate:>9.0%} {mrr:>7.4f} {mrr_both:>9.4f}   {by_category}")
+            if mrr >= full_mrr - CALIBRATION_TOLERANCE and (best is None or rate > best[2]):
+                best = (score, margin, rate, mrr_both >= full_mrr - CALIBRATION_TOLERANCE)
+    if best:
+        print("Recommended: FAST_PATH = True")
+        print(f"             FAST_PATH_SCORE = {best[0]}, FAST_PATH_MARGIN = {best[1]} ({best[2]:.0%} fast path)")
+        print(f"             FAST_PATH_SKIP_REWRITE = {best[3]}")
+    else:
+        print("No thresholds keep MRR within tolerance; set FAST_PATH = False")
 
 
 def run_cli_evaluation(test_number: int):
@@ -233,11 +443,18 @@ def run_cli_evaluation(test_number: int):
 
 
 def main():
-    """CLI to evaluate a specific test by row number."""
+    """CLI to evaluate a specific test by row number, or to compare the reranker backends."""
     if len(sys.argv) != 2:
-        print("Usage: uv run eval.py <test_row_number>")
+        print("Usage: uv run eval.py <test_row_number> | --rerankers | --calibrate")
         sys.exit(1)
 
+    if sys.argv[1] == "--rerankers":
+        compare_rerankers()
+        return
+    if sys.argv[1] == "--calibrate":
+        calibrate_fast_path()
+        return
+
     try:
         test_number = int(sys.argv[1])
     except ValueError:
@@ -1,11 +1,21 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import numpy as np
 from openai import OpenAI
 from dotenv import load_dotenv
 from chromadb import PersistentClient
-from litellm import completion
+from litellm import completion, encode, token_counter
 from pydantic import BaseModel, Field
 from pathlib import Path
 from tenacity import retry, wait_exponential
 
+from implementation import tracing
+from implementation.cache import SemanticCache, TieredCache, cache_key
+from implementation.lexical import BM25, LexicalIndex, rank_fusion
+from implementation.vector_index import load_index, normalize
+
 
 load_dotenv(override=True)
 
@@ -13,6 +23,7 @@ load_dotenv(override=True)
 MODEL = "openai/gpt-4.1-nano"
 #MODEL = "groq/openai/gpt-oss-120b"
 DB_NAME = str(Path(__file__).parent.parent / "preprocessed_db")
+MANIFEST_PATH = Path(DB_NAME) / "manifest.json"  # rewritten by every ingest run
 KNOWLEDGE_BASE_PATH = Path(__file__).parent.parent / "knowledge-base"
 SUMMARIES_PATH = Path(__file__).parent.parent / "summaries"
 
@@ -21,15 +32,101 @@ embedding_model = "text-embedding-3-large"
 # Backoff schedule for retrying failed LLM/API calls (e.g. rate limits): starts at 10s, doubles up to a 240s cap.
 wait = wait_exponential(multiplier=1, min=10, max=240)
 
-openai = OpenAI()
+# The embeddings client, created by openai_client() on first use so that importing this module (e.g. to run
+# against implementation/fake_llm.py) doesn't need OPENAI_API_KEY.
+openai = None
+_openai_lock = threading.Lock()
 
 # Connects to the on-disk Chroma vector store built by implementation/ingest.py.
 chroma = PersistentClient(path=DB_NAME)
 collection = chroma.get_or_create_collection(collection_name)
 
-RETRIEVAL_K = 20  # number of chunks pulled per embedding search, before reranking
+RETRIEVAL_K = 20  # number of chunks pulled per search (per query), before reranking
 FINAL_K = 10  # number of top-ranked chunks actually sent to the LLM as context
 
+# The FINAL_K chunks are picked from the reranked list by maximal marginal relevance: MMR_LAMBDA weighs
+# rerank position against similarity to chunks already picked (1.0 = rerank order only), so overlapping
+# chunks of one document don't crowd out others. Picks stop adding chunks past CONTEXT_TOKEN_BUDGET.
+MMR_LAMBDA = 0.7
+CONTEXT_TOKEN_BUDGET = 4000
+
+# Token budget for the whole answer prompt (see budget_prompt). Once the history is over HISTORY_TOKEN_BUDGET,
+# the older turns are folded into a rolling LLM summary (or dropped, with HISTORY_SUMMARY = False) and
+# the most recent ones kept verbatim; chunks are then added in rank order while they fit.
+PROMPT_TOKEN_BUDGET = 8000
+HISTORY_TOKEN_BUDGET = 2000
+HISTORY_SUMMARY = True
+prompt_totals = Counter()  # prompts built and tokens left out of them, reported by prompt_stats()
+
+# Fast path: when the original question's vector search has a clear winner (top cosine similarity at least
+# FAST_PATH_SCORE, and at least FAST_PATH_MARGIN above the runner-up), skip the rerank and optionally the
+# rewrite, answering with two LLM calls (or one) instead of three. Calibrate the thresholds, and whether
+# skipping the rewrite too keeps MRR, with `python -m evaluation.eval --calibrate`. Skipping the rewrite
+# means it can no longer overlap the first search, so questions that miss the fast path wait for both in
+# turn; it is off until calibration shows it pays. The thresholds are placeholders, so the fast path as a
+# whole is off until calibration has picked them for this knowledge base and embedding model.
+FAST_PATH = False
+FAST_PATH_SCORE = 0.7
+FAST_PATH_MARGIN = 0.05
+FAST_PATH_SKIP_REWRITE = False
+FAST_PATH_SKIP_RERANK = True
+fast_path_totals = Counter()  # questions retrieved, and how many skipped each stage
+_stats_lock = threading.Lock()
+
+# Vector search backend: "chroma" queries Chroma's HNSW index. The others search an in-process copy of the
+# vectors built from the collection (see vector_index.py): "exact" scores every vector with one matrix
+# product, which beats the Chroma round trip for a knowledge base this size; "truncate", "int8" and
+# "binary" search a compressed copy and rescore a shortlist at full precision
+# (`python -m implementation.vector_index --recall` compares their recall and speed).
+VECTOR_SEARCH = "chroma"
+_vector_index = None
+_vector_index_lock = threading.Lock()  # one thread loads (or builds) the index; the others wait for it
+
+# Hybrid retrieval: also rank every chunk by BM25 against the query (catches exact terms such as contract
+# names, acronyms and employee names that embeddings miss) and fuse both rankings with reciprocal rank
+# fusion. The BM25 index is built in memory from the collection on first use.
+HYBRID_SEARCH = True
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+# Reranking backend: "llm" asks MODEL to order the chunks (one LLM round trip per question); "bm25" fuses
+# the retrieval order with a BM25 ranking of the chunks on CPU; "cross-encoder" scores each question/chunk
+# pair locally with CROSS_ENCODER_MODEL (needs `pip install sentence-transformers`).
+# `python -m evaluation.eval --rerankers` compares their MRR, nDCG and latency.
+RERANKER = "llm"
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+_cross_encoder = None
+
+# Threads for retrieval calls that don't depend on each other (shared by all concurrent questions).
+executor = ThreadPoolExecutor(max_workers=16)
+
+# Caches for query rewrites, embeddings and rerank orders (see cache.py). Each has an in-memory LRU
+# tier; set CACHE_DIR to also keep them on disk across restarts, capped at CACHE_DISK_BYTES per cache.
+CACHE_SIZE = 1024  # entries per in-memory cache
+CACHE_DIR = None  # e.g. Path(__file__).parent.parent / "retrieval_cache"
+CACHE_DISK_BYTES = 100 * 2**20
+
+
+def make_cache(name):
+    """A TieredCache for one retrieval stage, with its own subdirectory when the disk tier is enabled."""
+    path = Path(CACHE_DIR) / name if CACHE_DIR else None
+    return TieredCache(CACHE_SIZE, path, CACHE_DISK_BYTES)
+
+
+rewrite_cache = make_cache("rewrite")
+embedding_cache = make_cache("embedding")
+rerank_cache = make_cache("rerank")
+summary_cache = make_cache("summary")
+
+# Semantic answer cache: a question without history whose embedding is at least ANSWER_CACHE_THRESHOLD
+# cosine-similar to an earlier one gets that answer and its chunks back, skipping retrieval and generation.
+# Cleared whenever ingest rebuilds the vector store.
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = 24 * 60 * 60  # seconds
+ANSWER_CACHE_SIZE = 1000
+answer_cache = SemanticCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+_store_version = None
+
 SYSTEM_PROMPT = """
 You are a knowledgeable, friendly assistant representing the company Insurellm.
 You are chatting with a user about Insurellm.
@@ -43,10 +140,22 @@ With this context, please answer the user's question. Be accurate, relevant and
 
 
 class Result(BaseModel):
-    """A single retrieved chunk: its text plus source/type metadata."""
+    """A single retrieved chunk: its text plus source/type metadata, and its id in the vector store."""
 
     page_content: str
     metadata: dict
+    id: str = ""
+    score: float = 0.0  # cosine similarity to the query, for chunks found by vector search
+
+
+class Prompt(BaseModel):
+    """Messages for the answer call, the chunks that fit in them, and the tokens the budget left out."""
+
+    messages: list[dict]
+    chunks: list[Result]
+    tokens: int
+    dropped_history_tokens: int = 0  # older turns, net of the summary that replaced them
+    dropped_chunk_tokens: int = 0
 
 
 class RankOrder(BaseModel):
@@ -57,9 +166,8 @@ class RankOrder(BaseModel):
     )
 
 
-@retry(wait=wait)
-def rerank(question, chunks):
-    """Ask the LLM to reorder retrieved chunks by relevance to the question (better than raw embedding similarity)."""
+def rank_messages(question, chunks):
+    """The reranker prompt: the question and the numbered chunks to order by relevance."""
     system_prompt = """
 You are a document re-ranker.
 You are provided with a question and a list of relevant chunks of text from a query of a knowledge base.
@@ -72,32 +180,242 @@ Reply only with the list of ranked chunk ids, nothing else. Include all the chun
     for index, chunk in enumerate(chunks):
         user_prompt += f"# CHUNK ID: {index + 1}:\n\n{chunk.page_content}\n\n"
     user_prompt += "Reply only with the list of ranked chunk ids, nothing else."
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
-    response = completion(model=MODEL, messages=messages, response_format=RankOrder)
+
+
+def clean_order(order, count):
+    """
+    A reranker's order made safe to cache: in-range 1-based positions without repeats, followed by any positions
+    it left out (in retrieval order). Raises ValueError, so the call is retried, if there were chunks to rank
+    but no position is usable.
+    """
+    seen = []
+    for position in order:
+        if 1 <= position <= count and position not in seen:
+            seen.append(position)
+    if count and not seen:
+        raise ValueError(f"Rerank order has no valid chunk ids: {order}")
+    return seen + [position for position in range(1, count + 1) if position not in seen]
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+def rank_chunks(question, chunks):
+    """Ask the LLM for the order of relevance of the chunks, as 1-based positions."""
+    response = completion(model=MODEL, messages=rank_messages(question, chunks), response_format=RankOrder)
+    tracing.add_usage(response)
     reply = response.choices[0].message.content
-    order = RankOrder.model_validate_json(reply).order
+    return clean_order(RankOrder.model_validate_json(reply).order, len(chunks))
+
+
+def rank_chunks_bm25(question, chunks):
+    """Fuse the retrieval order with a BM25 ranking of the chunks against the question, as 1-based positions."""
+    scores = BM25([chunk.page_content for chunk in chunks]).scores(question)
+    positions = list(range(1, len(chunks) + 1))
+    lexical = sorted(positions, key=lambda position: -scores[position - 1])
+    return rank_fusion([positions, lexical])
+
+
+def cross_encoder():
+    """The cross-encoder model, loaded on first use (sentence-transformers is only needed for this backend)."""
+    global _cross_encoder
+    if _cross_encoder is None:
+        from sentence_transformers import CrossEncoder
+
+        _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL)
+    return _cross_encoder
+
+
+def rank_chunks_cross_encoder(question, chunks):
+    """Score every question/chunk pair with the cross-encoder and order by score, as 1-based positions."""
+    scores = cross_encoder().predict([(question, chunk.page_content) for chunk in chunks])
+    return [int(index) + 1 for index in np.argsort(-np.asarray(scores))]
+
+
+RERANKERS = {"llm": rank_chunks, "bm25": rank_chunks_bm25, "cross-encoder": rank_chunks_cross_encoder}
+
+
+def rerank_key(question, chunks):
+    """Cache key of a rerank order: the backend and its model, the normalized question and the chunk ids."""
+    model = {"llm": MODEL, "cross-encoder": CROSS_ENCODER_MODEL}.get(RERANKER)
+    return cache_key(RERANKER, model, normalize_question(question), [chunk.id for chunk in chunks])
+
+
+def rerank(question, chunks):
+    """
+    Reorder retrieved chunks by relevance to the question (better than raw embedding similarity), using the
+    RERANKER backend. The order is cached by backend, question and the ordered chunk ids, so the same
+    retrieval is only ranked once.
+    """
+    key = rerank_key(question, chunks)
+    with tracing.span("rerank", backend=RERANKER, chunks=len(chunks)) as record:
+        order = rerank_cache.get(key)
+        record["cached"] = order is not None
+        if order is None:
+            order = RERANKERS[RERANKER](question, chunks)
+            rerank_cache.set(key, order)
     return [chunks[i - 1] for i in order]
 
 
-def make_rag_messages(question, history, chunks):
-    """Build the chat message list: system prompt with injected context, prior turns, then the new question."""
-    context = "\n\n".join(
-        f"Extract from {chunk.metadata['source']}:\n{chunk.page_content}" for chunk in chunks
-    )
+def format_chunk(chunk):
+    """A chunk as it appears in the context of the system prompt."""
+    return f"Extract from {chunk.metadata['source']}:\n{chunk.page_content}"
+
+
+def make_rag_messages(question, history, chunks, summary=None):
+    """
+    Build the chat message list: system prompt with injected context, a summary of earlier turns if
+    there is one, prior turns, then the new question.
+    """
+    context = "\n\n".join(format_chunk(chunk) for chunk in chunks)
     system_prompt = SYSTEM_PROMPT.format(context=context)
-    return (
-        [{"role": "system", "content": system_prompt}]
-        + history
-        + [{"role": "user", "content": question}]
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    return messages + history + [{"role": "user", "content": question}]
+
+
+def budget_prompt(question, history, chunks):
+    """
+    Assemble the answer prompt within PROMPT_TOKEN_BUDGET: compact the history to HISTORY_TOKEN_BUDGET
+    (keeping the most recent turns verbatim), then add chunks in rank order while they fit.
+    """
+    history_tokens = token_counter(model=MODEL, messages=history) if history else 0
+    summary = None
+    dropped_history = 0
+    if history_tokens > HISTORY_TOKEN_BUDGET:
+        recent = []
+        for message in reversed(history):
+            if token_counter(model=MODEL, messages=[message] + recent) > HISTORY_TOKEN_BUDGET:
+                break
+            recent.insert(0, message)
+        older = history[: len(history) - len(recent)]
+        dropped_history = token_counter(model=MODEL, messages=older)
+        if HISTORY_SUMMARY:
+            summary = summarize_history(older)
+            dropped_history -= count_tokens(summary)
+        history = recent
+    available = PROMPT_TOKEN_BUDGET - token_counter(
+        model=MODEL, messages=make_rag_messages(question, history, [], summary)
     )
+    fitted = []
+    dropped_chunks = 0
+    for chunk in chunks:
+        size = count_tokens(format_chunk(chunk)) + 1  # plus the blank line between extracts
+        if size <= available:
+            fitted.append(chunk)
+            available -= size
+        else:
+            dropped_chunks += size
+    messages = make_rag_messages(question, history, fitted, summary)
+    prompt = Prompt(
+        messages=messages,
+        chunks=fitted,
+        tokens=token_counter(model=MODEL, messages=messages),
+        dropped_history_tokens=max(dropped_history, 0),
+        dropped_chunk_tokens=dropped_chunks,
+    )
+    with _stats_lock:
+        prompt_totals.update(
+            prompts=1,
+            prompt_tokens=prompt.tokens,
+            dropped_history_tokens=prompt.dropped_history_tokens,
+            dropped_chunk_tokens=prompt.dropped_chunk_tokens,
+        )
+    return prompt
+
+
+def prompt_stats():
+    """Prompts built so far, their total tokens, and the tokens the budget left out of them."""
+    with _stats_lock:
+        return dict(prompt_totals)
+
+
+def fast_path_stats():
+    """Questions retrieved so far, and the share of them that skipped the rewrite and the rerank."""
+    with _stats_lock:
+        questions = fast_path_totals["questions"]
+        return {
+            "questions": questions,
+            "rewrite_skip_rate": fast_path_totals["skipped_rewrite"] / questions if questions else 0.0,
+            "rerank_skip_rate": fast_path_totals["skipped_rerank"] / questions if questions else 0.0,
+        }
+
+
+def summarize_history(turns):
+    """
+    Rolling summary of older conversation turns. The summary of the longest already-summarized prefix is
+    extended with the turns after it, so each new turn costs one short LLM call rather than a full re-read.
+    Only the lookup of the whole history counts towards the cache's hit rate, not the prefix probes.
+    """
+    key = cache_key(MODEL, turns)
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary
+    previous, start = None, 0
+    for cut in range(len(turns) - 1, 0, -1):
+        previous = summary_cache.peek(cache_key(MODEL, turns[:cut]))
+        if previous is not None:
+            start = cut
+            break
+    with tracing.span("summarize", turns=len(turns) - start):
+        summary = generate_summary(previous, turns[start:])
+    summary_cache.set(key, summary)
+    return summary
+
+
+def summary_messages(previous, turns):
+    """The prompt folding conversation turns into a summary, extending the previous one if given."""
+    transcript = "\n\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    message = f"""
+You are summarizing a conversation between a user and an assistant answering questions about the company Insurellm.
+
+Summary of the conversation so far:
+{previous or "(none)"}
+
+Further turns of the conversation:
+{transcript}
+
+Respond only with an updated summary of the whole conversation in a short paragraph.
+Keep the names, products, figures and facts that the user may refer back to.
+"""
+    return [{"role": "system", "content": message}]
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+def generate_summary(previous, turns):
+    """Ask the LLM to fold conversation turns into a short summary, extending the previous one if given."""
+    response = completion(model=MODEL, messages=summary_messages(previous, turns))
+    tracing.add_usage(response)
+    return response.choices[0].message.content
+
+
+def normalize_question(question):
+    """Case- and whitespace-insensitive form of a question, for cache keys."""
+    return " ".join(question.lower().split())
+
+
+def rewrite_key(question, history=[]):
+    """Cache key of a query rewrite: the model, the normalized question and the history."""
+    return cache_key(MODEL, normalize_question(question), history)
 
 
-@retry(wait=wait)
 def rewrite_query(question, history=[]):
-    """Rewrite the user's question to be a more specific question that is more likely to surface relevant content in the Knowledge Base."""
+    """Rewrite the question for search, reusing the rewrite of the same (normalized) question and history."""
+    key = rewrite_key(question, history)
+    with tracing.span("rewrite") as record:
+        rewritten = rewrite_cache.get(key)
+        record["cached"] = rewritten is not None
+        if rewritten is None:
+            rewritten = generate_rewrite(question, history)
+            rewrite_cache.set(key, rewritten)
+    return rewritten
+
+
+def rewrite_messages(question, history=[]):
+    """The prompt asking for a short search query for the question."""
     message = f"""
 You are in a conversation with a user, answering questions about the company Insurellm.
 You are about to look up information in a Knowledge Base to answer the user's question.
@@ -112,53 +430,353 @@ Respond only with a short, refined question that you will use to search the Know
 It should be a VERY short specific question most likely to surface content. Focus on the question details.
 IMPORTANT: Respond ONLY with the precise knowledgebase query, nothing else.
 """
-    response = completion(model=MODEL, messages=[{"role": "system", "content": message}])
+    return [{"role": "system", "content": message}]
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+def generate_rewrite(question, history=[]):
+    """Rewrite the user's question to be a more specific question that is more likely to surface relevant content in the Knowledge Base."""
+    response = completion(model=MODEL, messages=rewrite_messages(question, history))
+    tracing.add_usage(response)
     return response.choices[0].message.content
 
 
 def merge_chunks(chunks, reranked):
     """Combine two chunk lists, keeping all of `chunks` and adding only chunks from `reranked` not already present."""
     merged = chunks[:]
-    existing = [chunk.page_content for chunk in chunks]
+    existing = {chunk.id for chunk in chunks}
     for chunk in reranked:
-        if chunk.page_content not in existing:
+        if chunk.id not in existing:
             merged.append(chunk)
+            existing.add(chunk.id)
     return merged
 
 
+def count_tokens(text):
+    """Number of tokens in the text for MODEL's tokenizer."""
+    return len(encode(model=MODEL, text=text))
+
+
+def chunk_embeddings(chunks):
+    """
+    Unit-length stored embeddings of the chunks, in order: from the in-process vector index when it is loaded
+    and has them all, otherwise from the collection by id. None if any chunk is no longer stored.
+    """
+    ids = [chunk.id for chunk in chunks]
+    index = _vector_index
+    if index is not None and (vectors := index.vectors(ids)) is not None:
+        return vectors
+    found = collection.get(ids=ids, include=["embeddings"])
+    by_id = dict(zip(found["ids"], found["embeddings"]))
+    if any(id not in by_id for id in ids):
+        return None
+    return normalize(np.asarray([by_id[id] for id in ids], dtype=np.float32))
+
+
+def select_chunks(chunks):
+    """
+    Pick up to FINAL_K of the reranked chunks by maximal marginal relevance, skipping any that would take
+    the context past CONTEXT_TOKEN_BUDGET. Relevance falls linearly with rerank position; redundancy is the
+    highest cosine similarity to a chunk already picked. If a chunk's embedding is gone (deleted by an ingest
+    since it was retrieved), the chunks are taken in rank order instead.
+    """
+    if not chunks:
+        return []
+    similarity = None
+    if MMR_LAMBDA < 1 and (vectors := chunk_embeddings(chunks)) is not None:
+        similarity = vectors @ vectors.T
+    relevance = 1 - np.arange(len(chunks)) / len(chunks)
+    redundancy = np.zeros(len(chunks))
+    remaining = list(range(len(chunks)))
+    selected = []
+    tokens = 0
+    while remaining and len(selected) < FINAL_K:
+        scores = MMR_LAMBDA * relevance[remaining] - (1 - MMR_LAMBDA) * redundancy[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        size = count_tokens(chunks[best].page_content)
+        if tokens + size > CONTEXT_TOKEN_BUDGET:
+            continue
+        selected.append(best)
+        tokens += size
+        if similarity is not None:
+            redundancy = np.maximum(redundancy, similarity[best])
+    return [chunks[index] for index in selected]
+
+
+def vector_index():
+    """The compressed vector index, loaded on first use (and rebuilt if the collection changed since)."""
+    global _vector_index
+    index = _vector_index
+    if index is None:
+        with _vector_index_lock:
+            if _vector_index is None:
+                _vector_index = load_index(collection)
+            index = _vector_index
+    return index
+
+
+def openai_client():
+    """The OpenAI client for embeddings, created on first use."""
+    global openai
+    client = openai
+    if client is None:
+        with _openai_lock:
+            if openai is None:
+                openai = OpenAI()
+            client = openai
+    return client
+
+
+def embed(texts):
+    """Embed texts, taking cached vectors where possible and fetching the rest in one request."""
+    keys = [cache_key(embedding_model, text) for text in texts]
+    vectors = [embedding_cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        with tracing.span("embed", texts=len(missing)):
+            response = openai_client().embeddings.create(model=embedding_model, input=[texts[i] for i in missing])
+            tracing.add_usage(response)
+        for i, item in zip(missing, response.data):
+            vectors[i] = item.embedding
+            embedding_cache.set(keys[i], item.embedding)
+    return vectors
+
+
+def query_chunks(query_embeddings):
+    """Return the RETRIEVAL_K nearest chunks for each query embedding, using the VECTOR_SEARCH backend."""
+    with tracing.span("vector_search", backend=VECTOR_SEARCH, queries=len(query_embeddings)):
+        return search_vectors(query_embeddings)
+
+
+def search_vectors(query_embeddings):
+    """The body of query_chunks: the nearest chunks per query embedding, from the VECTOR_SEARCH backend."""
+    if VECTOR_SEARCH == "chroma":
+        results = collection.query(query_embeddings=query_embeddings, n_results=RETRIEVAL_K)
+        # Chroma's default space is squared L2; for unit-length embeddings that is 2 - 2 * cosine similarity.
+        return [
+            [
+                Result(page_content=document, metadata=metadata, id=id, score=1 - distance / 2)
+                for id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            for ids, documents, metadatas, distances in zip(
+                results["ids"], results["documents"], results["metadatas"], results["distances"]
+            )
+        ]
+    index = vector_index()
+    queries = normalize(np.asarray(query_embeddings, dtype=np.float32))
+    return [
+        [
+            Result(page_content=index.documents[row], metadata=index.metadatas[row], id=index.ids[row], score=score)
+            for row, score in zip(rows, index.full[rows] @ query)
+        ]
+        for query, rows in zip(queries, index.search(queries, RETRIEVAL_K, mode=VECTOR_SEARCH))
+    ]
+
+
+def lexical_index():
+    """The BM25 index over the collection, built on first use."""
+    global _lexical_index
+    index = _lexical_index
+    if index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                _lexical_index = LexicalIndex(collection)
+            index = _lexical_index
+    return index
+
+
+def load_indexes():
+    """Load (or build) the in-process search indexes the settings use, so the first question doesn't wait for them."""
+    check_store_version()
+    if VECTOR_SEARCH != "chroma":
+        vector_index()
+    if HYBRID_SEARCH:
+        lexical_index()
+
+
 def fetch_context_unranked(question):
-    """Embed the question and return the top RETRIEVAL_K nearest chunks from the vector store (unranked)."""
-    query = openai.embeddings.create(model=embedding_model, input=[question]).data[0].embedding
-    results = collection.query(query_embeddings=[query], n_results=RETRIEVAL_K)
-    chunks = []
-    for result in zip(results["documents"][0], results["metadatas"][0]):
-        chunks.append(Result(page_content=result[0], metadata=result[1]))
-    return chunks
+    """
+    Embed the question and return the top RETRIEVAL_K nearest chunks from the vector store (unranked).
+    With HYBRID_SEARCH, the nearest chunks and the top BM25 matches are fused by reciprocal rank first.
+    """
+    return add_lexical_matches(question, query_chunks(embed([question]))[0])
+
+
+def add_lexical_matches(question, chunks):
+    """With HYBRID_SEARCH, fuse vector search results with the question's top BM25 matches by reciprocal rank."""
+    if not HYBRID_SEARCH:
+        return chunks
+    with tracing.span("lexical_search"):
+        index = lexical_index()
+        rows = index.search(question, RETRIEVAL_K)
+    lexical = [
+        Result(page_content=index.documents[row], metadata=index.metadatas[row], id=index.ids[row])
+        for row in rows
+    ]
+    by_id = {chunk.id: chunk for chunk in lexical + chunks}
+    fused = rank_fusion([[chunk.id for chunk in chunks], [chunk.id for chunk in lexical]])
+    return [by_id[id] for id in fused[:RETRIEVAL_K]]
+
+
+def confidence(chunks):
+    """(top score, margin over the runner-up) of the vector search that found the chunks."""
+    scores = sorted((chunk.score for chunk in chunks), reverse=True) + [0.0, 0.0]
+    return scores[0], scores[0] - scores[1]
+
+
+def is_confident(chunks):
+    """Whether the vector search has a clear winner, by the FAST_PATH thresholds."""
+    top, margin = confidence(chunks)
+    return FAST_PATH and top >= FAST_PATH_SCORE and margin >= FAST_PATH_MARGIN
+
+
+def winner_first(chunks):
+    """
+    Chunks in their retrieval (fused) order with the vector search's clear winner moved to the front. Lexical
+    matches carry no vector score, so sorting by score would push them all to the end.
+    """
+    winner = max(chunks, key=lambda chunk: chunk.score, default=None)
+    return [winner] + [chunk for chunk in chunks if chunk is not winner] if winner else []
+
+
+def searches_before_rewrite():
+    """Whether the original question is searched alone first, so a conclusive search can skip the rewrite."""
+    return FAST_PATH and FAST_PATH_SKIP_REWRITE
+
+
+def count_skipped_rewrite():
+    """Record a question whose conclusive first search skipped the rewrite."""
+    with _stats_lock:
+        fast_path_totals["skipped_rewrite"] += 1
+
+
+def is_new_query(original_question, rewritten_question):
+    """Whether the rewritten question differs from the original, so its search can find anything new."""
+    return rewritten_question.strip().lower() != original_question.strip().lower()
+
+
+def skips_rerank(confident):
+    """Whether a question's candidates skip the rerank (its first search was conclusive), counted in the stats."""
+    skip = FAST_PATH_SKIP_RERANK and confident
+    with _stats_lock:
+        fast_path_totals.update(questions=1, skipped_rerank=skip)
+    return skip
+
+
+def fetch_candidates(original_question):
+    """
+    Unranked candidates for a question: rewrite it into a short, search-friendly query, retrieve chunks for
+    both the original and rewritten question (covers different phrasings), and merge the two result sets.
+    The original question doesn't need the rewrite, so it is embedded and searched while the rewrite
+    LLM call is still running; only the rewritten question's search waits for it. With
+    FAST_PATH_SKIP_REWRITE the rewrite is skipped when the original question's search is conclusive.
+    Returns (candidates, whether the original question's search was conclusive).
+    """
+    check_store_version()
+    if searches_before_rewrite():
+        chunks1 = fetch_context_unranked(original_question)
+        if is_confident(chunks1):
+            count_skipped_rewrite()
+            return chunks1, True
+        rewritten_question = rewrite_query(original_question)
+    else:
+        rewrite = executor.submit(copy_context().run, rewrite_query, original_question)  # traced in this request
+        chunks1 = fetch_context_unranked(original_question)
+        rewritten_question = rewrite.result()
+    chunks2 = fetch_context_unranked(rewritten_question) if is_new_query(original_question, rewritten_question) else []
+    return merge_chunks(chunks1, chunks2), is_confident(chunks1)
 
 
 def fetch_context(original_question):
     """
-    Full retrieval pipeline for a question:
-    1. Rewrite the question into a short, search-friendly query.
-    2. Retrieve chunks for both the original and rewritten question (covers different phrasings).
-    3. Merge the two result sets and rerank them by relevance.
-    4. Return only the top FINAL_K chunks to keep the context sent to the LLM small and focused.
+    Full retrieval pipeline for a question: fetch the candidates, rerank them by relevance, and select at
+    most FINAL_K diverse chunks within the token budget, to keep the context sent to the LLM small and focused.
+    On the fast path, when the original question's search had a clear winner, the candidates keep their
+    retrieval order with the winner moved to the front instead of being reranked.
+    """
+    candidates, confident = fetch_candidates(original_question)
+    if skips_rerank(confident):
+        candidates = winner_first(candidates)
+    else:
+        candidates = rerank(original_question, candidates)
+    with tracing.span("select", candidates=len(candidates)):
+        return select_chunks(candidates)
+
+
+def check_store_version():
+    """Drop the answer cache and in-process indexes if ingest has rebuilt the vector store since they were filled."""
+    global _store_version, _vector_index, _lexical_index
+    version = MANIFEST_PATH.stat().st_mtime_ns if MANIFEST_PATH.exists() else None
+    if version != _store_version:
+        answer_cache.clear()
+        _vector_index = None
+        _lexical_index = None
+        _store_version = version
+
+
+def cache_stats():
+    """Hit/miss metrics for every cache in the answering pipeline."""
+    return {
+        "answer": answer_cache.stats(),
+        "rewrite": rewrite_cache.stats(),
+        "embedding": embedding_cache.stats(),
+        "rerank": rerank_cache.stats(),
+        "summary": summary_cache.stats(),
+    }
+
+
+def lookup_answer(question, history):
     """
-    rewritten_question = rewrite_query(original_question)
-    chunks1 = fetch_context_unranked(original_question)
-    chunks2 = fetch_context_unranked(rewritten_question)
-    chunks = merge_chunks(chunks1, chunks2)
-    reranked = rerank(original_question, chunks)
-    return reranked[:FINAL_K]
+    Look the question up in the semantic answer cache; only questions without history use it.
+    Returns (cached (answer, chunks) or None, the question's embedding to store the answer under or None).
+    """
+    check_store_version()
+    if history:
+        return None, None
+    vector = embed([question])[0]  # reused by retrieval through the embedding cache
+    return cached_answer(vector), vector
+
+
+def cached_answer(vector):
+    """The semantic answer cache's (answer, chunks) for a question's embedding, or None."""
+    with tracing.span("answer_cache") as record:
+        cached = answer_cache.get(vector)
+        record["hit"] = cached is not None
+    return cached
 
 
-@retry(wait=wait)
 def answer_question(question: str, history: list[dict] = []) -> tuple[str, list]:
     """
     Answer a question using RAG: retrieve relevant chunks, then generate an answer grounded in them.
     Returns (answer_text, retrieved_chunks) so callers (e.g. the UI) can show the sources used.
+    Questions without history are served from the semantic answer cache when a similar one was asked before.
+    Each call is traced (see tracing.py).
+    """
+    with tracing.trace("answer_question", question=question):
+        cached, vector = lookup_answer(question, history)
+        if cached is not None:
+            return cached
+        result = generate_answer(question, history)
+        if vector is not None:
+            answer_cache.set(vector, result)
+        return result
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+def generate_answer(question, history=[]):
+    """Run the full pipeline for a question: retrieve and rerank context, then generate the answer."""
+    return answer_from_context(question, history, fetch_context(question))
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+def answer_from_context(question, history, chunks):
+    """
+    Generate the answer from chunks already retrieved for the question (e.g. shared with an evaluation).
+    Returns (answer_text, the chunks that fit in the prompt).
     """
-    chunks = fetch_context(question)
-    messages = make_rag_messages(question, history, chunks)
-    response = completion(model=MODEL, messages=messages)
-    return response.choices[0].message.content, chunks
+    with tracing.span("budget_prompt"):
+        prompt = budget_prompt(question, history, chunks)
+    with tracing.span("completion"):
+        response = completion(model=MODEL, messages=prompt.messages)
+        tracing.add_usage(response)
+    return response.choices[0].message.content, prompt.chunks
@@ -0,0 +1,249 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager, nullcontext
+
+from litellm import acompletion
+from openai import AsyncOpenAI
+from tenacity import retry
+
+from implementation import answer, tracing
+from implementation.answer import RankOrder, wait
+
+
+# Async variant of the answer pipeline in answer.py, for serving many chat sessions from one process.
+# LLM and embedding calls use async clients; Chroma has no async client for a local store, so its
+# queries (and the CPU-bound context selection and prompt budgeting) run in worker threads. Settings,
+# caches and statistics are shared with answer.py.
+MAX_CONCURRENT_ANSWERS = 32  # questions answered at once; further ones wait for a slot
+MAX_QUEUED_ANSWERS = 128  # questions allowed to wait for a slot before new ones are turned away
+
+aopenai = None  # the async embeddings client, created by aopenai_client() on first use, like answer.openai
+_slots = None
+_queued = 0
+
+
+class Overloaded(Exception):
+    """Raised when MAX_QUEUED_ANSWERS questions are already waiting for a slot."""
+
+
+def slots():
+    """The semaphore limiting answers in progress, created on first use."""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_CONCURRENT_ANSWERS)
+    return _slots
+
+
+@asynccontextmanager
+async def admitted():
+    """Hold one of the MAX_CONCURRENT_ANSWERS slots, queueing for it; raise Overloaded if the queue is full."""
+    global _queued
+    if _queued >= MAX_QUEUED_ANSWERS:
+        raise Overloaded(f"{_queued} questions are already waiting")
+    _queued += 1
+    try:
+        await slots().acquire()
+    finally:
+        _queued -= 1
+    try:
+        yield
+    finally:
+        slots().release()
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+async def arank_chunks(question, chunks):
+    """Async rank_chunks: ask the LLM for the order of relevance of the chunks, as 1-based positions."""
+    response = await acompletion(
+        model=answer.MODEL, messages=answer.rank_messages(question, chunks), response_format=RankOrder
+    )
+    tracing.add_usage(response)
+    order = RankOrder.model_validate_json(response.choices[0].message.content).order
+    return answer.clean_order(order, len(chunks))
+
+
+async def arerank(question, chunks):
+    """Async rerank; the local backends run in a worker thread."""
+    key = answer.rerank_key(question, chunks)
+    with tracing.span("rerank", backend=answer.RERANKER, chunks=len(chunks)) as record:
+        order = answer.rerank_cache.get(key)
+        record["cached"] = order is not None
+        if order is None:
+            if answer.RERANKER == "llm":
+                order = await arank_chunks(question, chunks)
+            else:
+                order = await asyncio.to_thread(answer.RERANKERS[answer.RERANKER], question, chunks)
+            answer.rerank_cache.set(key, order)
+    return [chunks[i - 1] for i in order]
+
+
+async def arewrite_query(question, history=[]):
+    """Async rewrite_query, sharing its cache."""
+    key = answer.rewrite_key(question, history)
+    with tracing.span("rewrite") as record:
+        rewritten = answer.rewrite_cache.get(key)
+        record["cached"] = rewritten is not None
+        if rewritten is None:
+            rewritten = await agenerate_rewrite(question, history)
+            answer.rewrite_cache.set(key, rewritten)
+    return rewritten
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+async def agenerate_rewrite(question, history=[]):
+    """Async generate_rewrite."""
+    response = await acompletion(model=answer.MODEL, messages=answer.rewrite_messages(question, history))
+    tracing.add_usage(response)
+    return response.choices[0].message.content
+
+
+def aopenai_client():
+    """The async OpenAI client for embeddings, created on first use."""
+    global aopenai
+    if aopenai is None:
+        aopenai = AsyncOpenAI()
+    return aopenai
+
+
+async def aembed(texts):
+    """Async embed, sharing its cache."""
+    keys = [answer.cache_key(answer.embedding_model, text) for text in texts]
+    vectors = [answer.embedding_cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        with tracing.span("embed", texts=len(missing)):
+            response = await aopenai_client().embeddings.create(
+                model=answer.embedding_model, input=[texts[i] for i in missing]
+            )
+            tracing.add_usage(response)
+        for i, item in zip(missing, response.data):
+            vectors[i] = item.embedding
+            answer.embedding_cache.set(keys[i], item.embedding)
+    return vectors
+
+
+async def afetch_context_unranked(question):
+    """Async fetch_context_unranked. BM25 (and building its index after an ingest) runs in a worker thread."""
+    chunks = (await asyncio.to_thread(answer.query_chunks, await aembed([question])))[0]
+    return await asyncio.to_thread(answer.add_lexical_matches, question, chunks)
+
+
+async def afetch_candidates(original_question):
+    """Async fetch_candidates: the rewrite and the original question's search run concurrently."""
+    answer.check_store_version()
+    if answer.searches_before_rewrite():
+        chunks1 = await afetch_context_unranked(original_question)
+        if answer.is_confident(chunks1):
+            answer.count_skipped_rewrite()
+            return chunks1, True
+        rewritten_question = await arewrite_query(original_question)
+    else:
+        chunks1, rewritten_question = await asyncio.gather(
+            afetch_context_unranked(original_question), arewrite_query(original_question)
+        )
+    chunks2 = []
+    if answer.is_new_query(original_question, rewritten_question):
+        chunks2 = await afetch_context_unranked(rewritten_question)
+    return answer.merge_chunks(chunks1, chunks2), answer.is_confident(chunks1)
+
+
+async def afetch_context(original_question):
+    """Async fetch_context."""
+    candidates, confident = await afetch_candidates(original_question)
+    if answer.skips_rerank(confident):
+        candidates = answer.winner_first(candidates)
+    else:
+        candidates = await arerank(original_question, candidates)
+    with tracing.span("select", candidates=len(candidates)):
+        return await asyncio.to_thread(answer.select_chunks, candidates)
+
+
+async def abuild_prompt(question, history):
+    """
+    Retrieve the context for the question and assemble the answer prompt around it. Budgeting runs in a
+    worker thread, including any history summary call.
+    """
+    chunks = await afetch_context(question)
+    with tracing.span("budget_prompt"):
+        return await asyncio.to_thread(answer.budget_prompt, question, history, chunks)
+
+
+async def alookup_answer(question, history):
+    """Async lookup_answer."""
+    answer.check_store_version()
+    if history:
+        return None, None
+    vector = (await aembed([question]))[0]
+    return answer.cached_answer(vector), vector
+
+
+async def aanswer_question(question: str, history: list[dict] = []) -> tuple[str, list]:
+    """
+    Async answer_question: returns (answer_text, retrieved_chunks). Waits for one of the
+    MAX_CONCURRENT_ANSWERS slots, or raises Overloaded if too many questions are already waiting.
+    """
+    async with admitted():
+        async with tracing.atrace("answer_question", question=question):
+            cached, vector = await alookup_answer(question, history)
+            if cached is not None:
+                return cached
+            result = await agenerate_answer(question, history)
+            if vector is not None:
+                answer.answer_cache.set(vector, result)
+            return result
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+async def agenerate_answer(question, history=[]):
+    """Async generate_answer."""
+    prompt = await abuild_prompt(question, history)
+    with tracing.span("completion"):
+        response = await acompletion(model=answer.MODEL, messages=prompt.messages)
+        tracing.add_usage(response)
+    return response.choices[0].message.content, prompt.chunks
+
+
+async def astream_answer(
+    question: str, history: list[dict] = [], trace: tracing.Trace | None = None, admit: bool = True
+):
+    """
+    Streaming variant of aanswer_question, yielding (answer_so_far, retrieved_chunks): first with an empty
+    answer as soon as retrieval finishes, then again as each token of the answer arrives. Pass a Trace to
+    read the stage timings once the answer is complete. Holds a slot for the whole answer, like
+    aanswer_question; admit=False when the caller already holds one.
+    """
+    trace = trace or tracing.Trace("stream_answer")
+    trace.record["question"] = question
+    async with admitted() if admit else nullcontext():
+        # The trace is only made current between yields, since the caller may resume the generator elsewhere.
+        with trace.activate():
+            cached, vector = await alookup_answer(question, history)
+            if cached is None:
+                prompt = await abuild_prompt(question, history)
+        if cached is not None:
+            await asyncio.to_thread(trace.finish)
+            yield cached
+            return
+        yield "", prompt.chunks
+        text = ""
+        with trace.span("completion") as record:
+            start = time.perf_counter()
+            with trace.activate():
+                parts = await aopen_stream(prompt.messages)
+            async for part in parts:
+                tracing.add_usage(part, record)  # only the final part carries usage
+                if part.choices and part.choices[0].delta.content:
+                    record.setdefault("first_token", round(time.perf_counter() - start, 4))
+                    text += part.choices[0].delta.content
+                    yield text, prompt.chunks
+        await asyncio.to_thread(trace.finish)
+    if vector is not None:
+        answer.answer_cache.set(vector, (text, prompt.chunks))
+
+
+@retry(wait=wait, before_sleep=tracing.count_retry)
+async def aopen_stream(messages):
+    """Start a streamed completion of the answer (retried until the stream opens)."""
+    return await acompletion(
+        model=answer.MODEL, messages=messages, stream=True, stream_options={"include_usage": True}
+    )
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def hit_rate(hits, misses):
+    """Hit/miss counters as a metrics dict."""
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+def cache_key(*parts):
+    """Hash any JSON-serializable parts into a fixed-length key."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-memory cache holding the `max_entries` most recently used values."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DiskCache:
+    """
+    One JSON file per key under `path`. When the files exceed `max_bytes` in total, the least recently
+    used ones (by modification time, refreshed on every hit) are deleted.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = {file: file.stat().st_size for file in self.path.glob("*.json")}
+
+    def get(self, key):
+        file = self.path / f"{key}.json"
+        try:
+            value = json.loads(file.read_text(encoding="utf-8"))
+            os.utime(file)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def set(self, key, value):
+        file = self.path / f"{key}.json"
+        temp = file.with_suffix(".tmp")
+        temp.write_text(json.dumps(value), encoding="utf-8")
+        temp.replace(file)
+        with self.lock:
+            self.sizes[file] = file.stat().st_size
+            if sum(self.sizes.values()) > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Delete least recently used files until the cache is back to 90% of max_bytes."""
+        by_age = sorted(self.sizes, key=lambda file: file.stat().st_mtime if file.exists() else 0)
+        total = sum(self.sizes.values())
+        for file in by_age:
+            if total <= self.max_bytes * 0.9:
+                break
+            total -= self.sizes.pop(file)
+            file.unlink(missing_ok=True)
+
+    def clear(self):
+        with self.lock:
+            for file in self.sizes:
+                file.unlink(missing_ok=True)
+            self.sizes.clear()
+
+
+class TieredCache:
+    """An in-memory LRU in front of an optional disk cache; disk hits are promoted to memory."""
+
+    def __init__(self, max_entries, path=None, max_bytes=None):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskCache(path, max_bytes) if path is not None else None
+        self.lock = threading.Lock()  # guards the counters; the tiers have their own locks
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.peek(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def peek(self, key):
+        """Look a key up like get(), without counting a hit or miss (for probing several candidate keys)."""
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        with self.lock:
+            return hit_rate(self.hits, self.misses)
+
+
+class SemanticCache:
+    """
+    Maps embeddings to values: a lookup returns the value stored for the most similar embedding, if its
+    cosine similarity is at least `threshold`. Entries expire `ttl` seconds after being stored and their
+    slots are reused first; the least recently used live entry is replaced only once `max_entries` are
+    held. Vectors live in one preallocated matrix, so a lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, threshold, ttl, max_entries):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.vectors = None  # allocated on first insert, once the dimension is known
+        self.expires = np.zeros(max_entries)
+        self.values = OrderedDict()  # slot -> value, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, vector):
+        with self.lock:
+            if self.values:
+                scores = self.vectors @ self.normalize(vector)
+                scores[self.expires <= time.time()] = -np.inf  # free slots have expires == 0
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.threshold:
+                    self.values.move_to_end(slot)
+                    self.hits += 1
+                    return self.values[slot]
+            self.misses += 1
+            return None
+
+    def purge(self):
+        """Free the slots of expired entries; the caller holds the lock."""
+        for slot in np.flatnonzero((self.expires > 0) & (self.expires <= time.time())):
+            del self.values[int(slot)]
+            self.expires[slot] = 0
+
+    def set(self, vector, value):
+        vector = self.normalize(vector)
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            self.purge()
+            if len(self.values) < self.max_entries:
+                slot = next(i for i in range(self.max_entries) if i not in self.values)
+            else:
+                slot, _ = self.values.popitem(last=False)
+            self.vectors[slot] = vector
+            self.expires[slot] = time.time() + self.ttl
+            self.values[slot] = value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.expires[:] = 0
+
+    def stats(self):
+        with self.lock:
+            self.purge()
+            return {**hit_rate(self.hits, self.misses), "entries": len(self.values)}
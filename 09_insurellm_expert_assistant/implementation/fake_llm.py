@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import re
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from litellm import acompletion, completion
+
+from implementation import answer, async_answer
+from implementation.answer import RankOrder
+
+
+# Offline stand-in for the LLM and embedding APIs, for load-testing the pipeline without network access or
+# API spend. Calls take a fixed latency; answers are placeholder text through litellm's mock_response (so
+# responses, streams and usage have the real shapes), rerank orders are unchanged, and embeddings are
+# deterministic pseudo-random unit vectors of the collection's dimension.
+FAKE_LLM_LATENCY = 0.5  # seconds per LLM call
+FAKE_EMBEDDING_LATENCY = 0.05  # seconds per embedding request
+FAKE_ANSWER = "This is a placeholder answer from the fake LLM, which doesn't read the context."
+
+
+def fake_content(messages, response_format):
+    """The reply for a call: the identity order for reranks, placeholder text otherwise."""
+    if response_format is RankOrder:
+        count = len(re.findall(r"# CHUNK ID", messages[-1]["content"]))
+        return RankOrder(order=list(range(1, count + 1))).model_dump_json()
+    return FAKE_ANSWER
+
+
+def fake_completion(model, messages, response_format=None, **kwargs):
+    """Stand-in for litellm.completion."""
+    time.sleep(FAKE_LLM_LATENCY)
+    return completion(model=model, messages=messages, mock_response=fake_content(messages, response_format), **kwargs)
+
+
+async def fake_acompletion(model, messages, response_format=None, **kwargs):
+    """Stand-in for litellm.acompletion."""
+    await asyncio.sleep(FAKE_LLM_LATENCY)
+    content = fake_content(messages, response_format)
+    return await acompletion(model=model, messages=messages, mock_response=content, **kwargs)
+
+
+def fake_vector(text, dimensions):
+    """A unit vector seeded by the text, so the same text always embeds the same way."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_embeddings(texts, dimensions):
+    """An embeddings response in the OpenAI client's shape."""
+    return SimpleNamespace(
+        data=[SimpleNamespace(embedding=fake_vector(text, dimensions)) for text in texts],
+        usage=SimpleNamespace(prompt_tokens=sum(len(text.split()) for text in texts)),
+    )
+
+
+class FakeEmbeddings:
+    """Stand-in for OpenAI().embeddings."""
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def create(self, model, input):
+        time.sleep(FAKE_EMBEDDING_LATENCY)
+        return fake_embeddings(input, self.dimensions)
+
+
+class FakeAsyncEmbeddings(FakeEmbeddings):
+    """Stand-in for AsyncOpenAI().embeddings."""
+
+    async def create(self, model, input):
+        await asyncio.sleep(FAKE_EMBEDDING_LATENCY)
+        return fake_embeddings(input, self.dimensions)
+
+
+def install():
+    """Route the sync and async answer pipelines' LLM and embedding calls to the fakes."""
+    sample = answer.collection.get(limit=1, include=["embeddings"])["embeddings"]
+    dimensions = len(sample[0]) if len(sample) else 3072
+    answer.completion = fake_completion
+    answer.openai = SimpleNamespace(embeddings=FakeEmbeddings(dimensions))
+    async_answer.acompletion = fake_acompletion
+    async_answer.aopenai = SimpleNamespace(embeddings=FakeAsyncEmbeddings(dimensions))
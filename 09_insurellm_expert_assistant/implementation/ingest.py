@@ -1,12 +1,22 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from pathlib import Path
+import numpy as np
 from openai import OpenAI
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from chromadb import PersistentClient
 from tqdm import tqdm
-from litellm import completion
-from multiprocessing import Pool
-from tenacity import retry, wait_exponential
+from litellm import RateLimitError, acompletion, cost_per_token, encode
+from tenacity import retry, retry_if_not_exception_type, wait_exponential
 
 
 load_dotenv(override=True)
@@ -20,11 +30,37 @@ DB_NAME = str(Path(__file__).parent.parent / "preprocessed_db")
 collection_name = "docs"
 embedding_model = "text-embedding-3-large"
 KNOWLEDGE_BASE_PATH = Path(__file__).parent.parent / "knowledge-base"
+MANIFEST_PATH = Path(DB_NAME) / "manifest.json"  # content hash per source file from the last ingest run
+# Validated chunking responses, one JSON file per (MODEL, prompt, document) so re-ingesting skips the LLM call.
+CHUNK_CACHE_PATH = Path(__file__).parent.parent / "chunk_cache"
 AVERAGE_CHUNK_SIZE = 60  # target characters per chunk; used to hint the LLM how many chunks to produce
+# Settings for the local, heading-based chunker (--chunker local): maximum characters per chunk,
+# and how many characters from the end of one chunk are repeated at the start of the next.
+LOCAL_CHUNK_SIZE = 1000
+LOCAL_CHUNK_OVERLAP = 200
+# Chunks of the same document whose word 5-grams overlap at least this much (Jaccard similarity,
+# estimated with MinHash + LSH) are collapsed into the first one. Set to None to keep everything.
+DEDUPE_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 16 bands of 4 rows: pairs above ~0.5 similarity almost always become candidates
 wait = wait_exponential(multiplier=1, min=10, max=240)
 
 
-WORKERS = 3  # parallel worker processes for chunking documents; lower to 1 if you hit rate limits
+# Chunking calls run concurrently as asyncio tasks, throttled to the provider's rate limits.
+# Concurrency is halved on every 429 and grows back as calls succeed, so these only need to
+# match your account tier, not be tuned by hand.
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+MAX_CONCURRENCY = 32
+RATE_LIMIT_BACKOFF = 20  # seconds to pause after a 429 that carries no Retry-After header
+
+# Embedding requests are split into batches that stay under the API's per-request limits
+# (300k tokens / 2048 inputs), and a few batches are embedded concurrently.
+EMBEDDING_BATCH_TOKENS = 250_000
+EMBEDDING_BATCH_SIZE = 2048
+EMBEDDING_WORKERS = 4
+QUEUE_SIZE = 16  # items buffered between streaming pipeline stages; bounds memory regardless of corpus size
 
 openai = OpenAI()
 
@@ -64,19 +100,121 @@ class Chunks(BaseModel):
     chunks: list[Chunk]
 
 
-def fetch_documents():
-    """A homemade version of the LangChain DirectoryLoader"""
-
-    documents = []
+class IngestStats:
+    """
+    Per-stage instrumentation for one ingest run: wall time, summed call time, call counts, retries
+    and token usage, optionally broken down per document. Updated from worker threads, hence the lock.
+    """
 
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(Counter)
+        self.spans = {}
+        self.documents = defaultdict(lambda: defaultdict(Counter))
+        self.lock = threading.Lock()
+
+    def record(self, stage, document=None, **values):
+        """Add values (e.g. calls=1, prompt_tokens=...) to a stage's totals, and to a document's if given."""
+        with self.lock:
+            self.stages[stage].update(values)
+            if document is not None:
+                self.documents[document][stage].update(values)
+
+    @contextmanager
+    def timed(self, stage, document=None):
+        """Time one call of a stage, counting it whether or not it succeeds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.record(stage, document, calls=1, seconds=end - start)
+            with self.lock:
+                first, last = self.spans.get(stage, (start, end))
+                self.spans[stage] = (min(first, start), max(last, end))
+
+    def costs(self):
+        """Estimated USD cost of the chunking and embedding calls, from litellm's price table (None if unknown)."""
+        chunking = self.stages.get("process_document", Counter())
+        embedding = self.stages.get("create_embeddings", Counter())
+        try:
+            chunking_cost = sum(
+                cost_per_token(
+                    model=MODEL,
+                    prompt_tokens=chunking["prompt_tokens"],
+                    completion_tokens=chunking["completion_tokens"],
+                )
+            )
+            embedding_cost = sum(cost_per_token(model=embedding_model, prompt_tokens=embedding["embedding_tokens"]))
+        except Exception:
+            return None
+        return {"chunking": chunking_cost, "embedding": embedding_cost, "total": chunking_cost + embedding_cost}
+
+    def report(self, per_document=False):
+        """The run's statistics as a JSON-serializable dict."""
+        stages = {}
+        for stage, values in self.stages.items():
+            stages[stage] = dict(values)
+            if stage in self.spans:
+                first, last = self.spans[stage]
+                stages[stage]["wall_seconds"] = last - first
+        report = {
+            "total_seconds": time.perf_counter() - self.started,
+            "stages": stages,
+            "cost_usd": self.costs(),
+        }
+        if per_document:
+            report["documents"] = {
+                source: {stage: dict(values) for stage, values in document.items()}
+                for source, document in self.documents.items()
+            }
+        return report
+
+    def print_summary(self):
+        """Print one line of totals per stage."""
+        for stage, values in self.report()["stages"].items():
+            details = ", ".join(
+                f"{key} {value:.1f}" if isinstance(value, float) else f"{key} {value}"
+                for key, value in values.items()
+            )
+            print(f"{stage}: {details}")
+
+
+stats = IngestStats()
+
+
+def count_retries(stage):
+    """tenacity before_sleep hook that records a retry and its backoff against `stage` (and the document, if any)."""
+
+    def before_sleep(retry_state):
+        args = retry_state.args
+        document = args[0]["source"] if args and isinstance(args[0], dict) else None
+        stats.record(stage, document, retries=1, retry_wait_seconds=retry_state.next_action.sleep)
+
+    return before_sleep
+
+
+def iter_documents():
+    """A homemade version of the LangChain DirectoryLoader, reading one file at a time."""
     for folder in KNOWLEDGE_BASE_PATH.iterdir():
         doc_type = folder.name
         for file in folder.rglob("*.md"):
-            with open(file, "r", encoding="utf-8") as f:
-                documents.append({"type": doc_type, "source": file.as_posix(), "text": f.read()})
+            with stats.timed("fetch_documents"), open(file, "r", encoding="utf-8") as f:
+                text = f.read()
+            yield {
+                "type": doc_type,
+                "source": file.as_posix(),
+                "text": text,
+                "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            }
+
 
-    print(f"Loaded {len(documents)} documents")
-    return documents
+def count_documents():
+    """How many documents iter_documents will yield, for the progress bar's total."""
+    return sum(1 for folder in KNOWLEDGE_BASE_PATH.iterdir() for _ in folder.rglob("*.md"))
 
 
 def make_prompt(document):
@@ -105,6 +243,11 @@ Respond with the chunks.
 """
 
 
+def count_tokens(text):
+    """Token count with the embedding model's tokenizer (bundled with litellm, so it works offline)."""
+    return len(encode(model=embedding_model, text=text))
+
+
 def make_messages(document):
     """Wrap the chunking prompt in a chat message list for the completion call."""
     return [
@@ -112,50 +255,590 @@ def make_messages(document):
     ]
 
 
-@retry(wait=wait)
-def process_document(document):
-    """Send one document to the LLM and parse its response into a list of chunk Results."""
-    messages = make_messages(document)
-    response = completion(model=MODEL, messages=messages, response_format=Chunks)
-    reply = response.choices[0].message.content
-    doc_as_chunks = Chunks.model_validate_json(reply).chunks
+def chunk_cache_path(document):
+    """Cache file for a document, keyed by the chunking model, the prompt and the document content."""
+    prompt_hash = hashlib.sha256(json.dumps(make_messages(document)).encode("utf-8")).hexdigest()
+    key = hashlib.sha256(f"{MODEL}\n{prompt_hash}\n{document['hash']}".encode("utf-8")).hexdigest()
+    return CHUNK_CACHE_PATH / f"{key}.json"
+
+
+def load_cached_chunks(document):
+    """Return the document's chunk Results from the cache, or None on a miss."""
+    path = chunk_cache_path(document)
+    if not path.exists():
+        return None
+    try:
+        doc_as_chunks = Chunks.model_validate_json(path.read_text(encoding="utf-8")).chunks
+    except ValidationError:
+        return None  # written by an older Chunk schema; chunk the document again
     return [chunk.as_result(document) for chunk in doc_as_chunks]
 
 
-def create_chunks(documents):
+def save_cached_chunks(document, chunks):
+    """Store a validated Chunks response, writing to a temp file first so readers never see a partial entry."""
+    path = chunk_cache_path(document)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix(".tmp")
+    temp.write_text(chunks.model_dump_json(), encoding="utf-8")
+    temp.replace(path)
+
+
+@retry(
+    wait=wait,
+    retry=retry_if_not_exception_type(RateLimitError),
+    before_sleep=count_retries("process_document"),
+)
+async def process_document(document):
     """
-    Create chunks using a number of workers in parallel.
-    If you get a rate limit error, set the WORKERS to 1.
+    Send one document to the LLM and parse its response into a list of chunk Results.
+    Rate limit errors are left to the ChunkingScheduler, which backs off for all requests.
+    """
+    messages = make_messages(document)
+    with stats.timed("process_document", document["source"]):
+        response = await acompletion(model=MODEL, messages=messages, response_format=Chunks)
+    stats.record(
+        "process_document",
+        document["source"],
+        prompt_tokens=response.usage.prompt_tokens,
+        completion_tokens=response.usage.completion_tokens,
+    )
+    reply = response.choices[0].message.content
+    parsed = Chunks.model_validate_json(reply)
+    save_cached_chunks(document, parsed)
+    return [chunk.as_result(document) for chunk in parsed.chunks]
+
+
+class TokenBucket:
+    """Allows `rate` units per minute, refilled continuously; acquire() waits until enough are available."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.level = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount):
+        amount = min(amount, self.rate)  # an oversized request still runs once the bucket is full
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60)
+                self.updated = now
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                await asyncio.sleep((amount - self.level) * 60 / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    Caps the number of in-flight requests. A rate limit error halves the cap and pauses new
+    requests for the Retry-After period; each full window of successes raises the cap by one again.
     """
-    chunks = []
-    with Pool(processes=WORKERS) as pool:
-        for result in tqdm(pool.imap_unordered(process_document, documents), total=len(documents)):
-            chunks.extend(result)
-    return chunks
 
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = maximum
+        self.active = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def throttle(self, retry_after):
+        self.limit = max(1, self.limit // 2)
+        self.successes = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self.successes = 0
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait in its 429 response, or RATE_LIMIT_BACKOFF if it didn't say."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        try:
+            return float(headers.get(header)) * scale
+        except (TypeError, ValueError):
+            continue
+    return RATE_LIMIT_BACKOFF
+
+
+def estimate_tokens(document):
+    """Rough TPM cost of chunking a document: the prompt plus a reply about twice the document (overlap + summaries)."""
+    return count_tokens(make_prompt(document)) + 2 * count_tokens(document["text"])
+
+
+class ChunkingScheduler:
+    """Runs process_document calls within the RPM/TPM budgets and the adaptive concurrency limit."""
+
+    def __init__(self):
+        self.requests = TokenBucket(REQUESTS_PER_MINUTE)
+        self.tokens = TokenBucket(TOKENS_PER_MINUTE)
+        self.limiter = AdaptiveLimiter(MAX_CONCURRENCY)
+
+    async def chunk(self, document):
+        estimate = estimate_tokens(document)
+        while True:
+            async with self.limiter:
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimate)
+                try:
+                    result = await process_document(document)
+                except RateLimitError as error:
+                    delay = retry_after(error)
+                    stats.record("process_document", document["source"], rate_limited=1, rate_limit_wait_seconds=delay)
+                    self.limiter.throttle(delay)
+                    continue
+            self.limiter.succeeded()
+            return result
+
+
+HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+
+def split_sections(text):
+    """Split markdown into (heading path, body) sections, one per heading, e.g. ("Avery Lancaster > Summary", ...)."""
+    sections = []
+    path = []
+    lines = []
+    in_code = False
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body:
+            sections.append((" > ".join(title for _, title in path), body))
+        lines.clear()
+
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        match = None if in_code else HEADING.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            path = [(depth, title) for depth, title in path if depth < level] + [(level, match.group(2))]
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+
+def split_text(text, size, overlap):
+    """
+    Split text into pieces of roughly `size` characters on line boundaries (long lines are cut
+    between words). Each piece after the first starts with the trailing lines of the previous one,
+    up to `overlap` characters, but never all of them and never past `size`.
+    """
+    units = []
+    for line in text.splitlines():
+        while len(line) > size:
+            cut = line.rfind(" ", 0, size)
+            cut = size if cut <= 0 else cut
+            units.append(line[:cut])
+            line = line[cut:].lstrip()
+        units.append(line)
+
+    pieces = []
+    current = []
+    length = 0
+    for unit in units:
+        if current and length + len(unit) + 1 > size:
+            if "\n".join(current).strip():
+                pieces.append("\n".join(current).strip())
+            carried = []
+            carried_length = 0
+            # Never the whole piece (its first line with text stays behind), or the next would repeat it.
+            first = next((i for i, line in enumerate(current) if line.strip()), len(current))
+            for previous in reversed(current[first + 1 :]):
+                if carried_length + len(previous) + 1 > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_length += len(previous) + 1
+            while carried and carried_length + len(unit) + 1 > size:
+                carried_length -= len(carried.pop(0)) + 1
+            current = carried
+            length = carried_length
+        current.append(unit)
+        length += len(unit) + 1
+    if "\n".join(current).strip():
+        pieces.append("\n".join(current).strip())
+    return pieces
+
+
+def chunk_document_locally(document, size=LOCAL_CHUNK_SIZE, overlap=LOCAL_CHUNK_OVERLAP):
+    """Chunk one document by its heading structure, prefixing each piece with its heading path as the headline."""
+    metadata = {"source": document["source"], "type": document["type"]}
+    results = []
+    for headline, body in split_sections(document["text"]):
+        headline = headline or Path(document["source"]).stem
+        for piece in split_text(body, size, overlap):
+            results.append(Result(page_content=headline + "\n\n" + piece, metadata=metadata))
+    return results
+
+
+def chunker_id(chunker):
+    """Identify the chunking configuration, so --incremental rebuilds everything when it changes."""
+    if chunker == "local":
+        return f"local:{LOCAL_CHUNK_SIZE}:{LOCAL_CHUNK_OVERLAP}:dedupe={DEDUPE_THRESHOLD}"
+    return f"llm:{MODEL}:dedupe={DEDUPE_THRESHOLD}"
+
+
+MINHASH_PRIME = 4294967291  # largest prime below 2**32, so (a * hash + b) never overflows uint64
+
+
+class NearDuplicateFilter:
+    """Detects near-duplicate texts with MinHash signatures bucketed into LSH bands."""
+
+    def __init__(self, threshold=DEDUPE_THRESHOLD):
+        rng = np.random.default_rng(0)  # fixed seed: the same chunks are always kept
+        self.a = rng.integers(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+        self.b = rng.integers(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+        self.threshold = threshold
+        self.signatures = []
+        self.buckets = [{} for _ in range(LSH_BANDS)]
+
+    def signature(self, text):
+        words = text.lower().split() or [""]
+        shingles = {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+        return ((np.outer(hashes, self.a) + self.b) % MINHASH_PRIME).min(axis=0)
+
+    def is_duplicate(self, text):
+        """True if text nearly duplicates a text seen before; otherwise remember it and return False."""
+        signature = self.signature(text)
+        keys = [band.tobytes() for band in np.split(signature, LSH_BANDS)]
+        candidates = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        for candidate in candidates:
+            if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                return True
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(len(self.signatures))
+        self.signatures.append(signature)
+        return False
+
+
+def remove_near_duplicates(chunks):
+    """
+    Drop chunks that nearly duplicate an earlier chunk from the same source, returning (kept, removed count).
+    Comparing within a source only keeps the result independent of other documents (so incremental runs
+    match full ones) and never loses a source whose text happens to resemble another's, like contract boilerplate.
+    """
+    if DEDUPE_THRESHOLD is None:
+        return chunks, 0
+    filters = {}
+    kept = []
+    for chunk in chunks:
+        source = chunk.metadata["source"]
+        if source not in filters:
+            filters[source] = NearDuplicateFilter()
+        if not filters[source].is_duplicate(chunk.page_content):
+            kept.append(chunk)
+    return kept, len(chunks) - len(kept)
+
+
+class EmbeddingBatcher:
+    """Accumulates (id, chunk) pairs into batches bounded by EMBEDDING_BATCH_TOKENS and EMBEDDING_BATCH_SIZE."""
+
+    def __init__(self):
+        self.batch = []
+        self.tokens = 0
+
+    def add(self, item):
+        """Add an item; returns the previous batch if the item didn't fit in it, otherwise None."""
+        count = count_tokens(item[1].page_content)
+        full = None
+        if self.batch and (
+            self.tokens + count > EMBEDDING_BATCH_TOKENS or len(self.batch) >= EMBEDDING_BATCH_SIZE
+        ):
+            full = self.flush()
+        self.batch.append(item)
+        self.tokens += count
+        return full
+
+    def flush(self):
+        """Return the batch in progress and start a new one."""
+        batch = self.batch
+        self.batch = []
+        self.tokens = 0
+        return batch
+
+
+@retry(wait=wait, before_sleep=count_retries("create_embeddings"))
+def embed_batch(texts):
+    """Embed one batch of texts; retried on its own so a failure doesn't restart the other batches."""
+    with stats.timed("create_embeddings"):
+        response = openai.embeddings.create(model=embedding_model, input=texts)
+    stats.record("create_embeddings", chunks=len(texts), embedding_tokens=response.usage.prompt_tokens)
+    return [e.embedding for e in response.data]
+
+
+def chunk_id(chunk):
+    """Deterministic id from the chunk's source path and content, so an unchanged chunk keeps its id across rebuilds."""
+    key = f"{chunk.metadata['source']}\n{chunk.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def new_items(collection, chunks, kept):
+    """
+    Pair chunks with their ids, dropping repeats and chunks the collection already holds.
+    Every id produced is added to `kept`, so remove_stale can tell which stored chunks are still current.
+    """
+    items = {}
+    for chunk in chunks:
+        id = chunk_id(chunk)
+        if id not in kept:
+            kept.add(id)
+            items[id] = chunk
+    existing = set(collection.get(ids=list(items), include=[])["ids"]) if items else set()
+    return [(id, chunk) for id, chunk in items.items() if id not in existing]
+
+
+def remove_stale(collection, kept, sources=None):
+    """Delete stored chunks whose ids weren't produced this run, across the collection or only for `sources`."""
+    if sources is not None and not sources:
+        return 0
+    where = {"source": {"$in": list(sources)}} if sources is not None else None
+    stale = [id for id in collection.get(where=where, include=[])["ids"] if id not in kept]
+    for start in range(0, len(stale), EMBEDDING_BATCH_SIZE):
+        collection.delete(ids=stale[start : start + EMBEDDING_BATCH_SIZE])
+    return len(stale)
+
+
+def open_collection(chroma):
+    """
+    Get the collection, recreating it if it was built with a different embedding model: chunk ids
+    don't depend on the model, so stored vectors would otherwise be silently reused.
+    Returns (collection, whether it was reset).
+    """
+    metadata = {"embedding_model": embedding_model}
+    collection = chroma.get_or_create_collection(collection_name, metadata=metadata)
+    if (collection.metadata or {}).get("embedding_model") == embedding_model:
+        return collection, False
+    chroma.delete_collection(collection_name)
+    return chroma.create_collection(collection_name, metadata=metadata), True
+
+
+def store_batch(collection, batch, vectors):
+    """Write one embedded batch of (id, chunk) pairs to Chroma."""
+    with stats.timed("store_batch"):
+        collection.upsert(
+            ids=[id for id, _ in batch],
+            embeddings=vectors,
+            documents=[chunk.page_content for _, chunk in batch],
+            metadatas=[chunk.metadata for _, chunk in batch],
+        )
+    stats.record("store_batch", chunks=len(batch))
 
-def create_embeddings(chunks):
-    """Embed all chunks and (re)build the Chroma collection from scratch with the results."""
-    chroma = PersistentClient(path=DB_NAME)
-    if collection_name in [c.name for c in chroma.list_collections()]:
-        chroma.delete_collection(collection_name)  # start fresh so stale chunks from a prior run don't linger
 
-    texts = [chunk.page_content for chunk in chunks]
-    emb = openai.embeddings.create(model=embedding_model, input=texts).data
-    vectors = [e.embedding for e in emb]
+def load_manifest():
+    """Return the manifest ({"chunker", "documents": {source: content hash}}) of the last run, or {} if there is none."""
+    if not MANIFEST_PATH.exists():
+        return {}
+    return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
 
-    collection = chroma.get_or_create_collection(collection_name)
 
-    ids = [str(i) for i in range(len(chunks))]
-    metas = [chunk.metadata for chunk in chunks]
+def save_manifest(hashes, chunker):
+    """Record the chunker and the {source: content hash} of every ingested document for the next --incremental run."""
+    MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    manifest = {"chunker": chunker_id(chunker), "documents": hashes}
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
 
-    collection.add(ids=ids, embeddings=vectors, documents=texts, metadatas=metas)
-    print(f"Vectorstore created with {collection.count()} documents")
+
+async def stream_ingest(collection, chunker, hashes=None):
+    """
+    Streaming ingest: loader -> chunker -> embedder -> Chroma writer, connected by bounded queues.
+    All stages run concurrently and a full queue blocks the stage feeding it, so only a few documents'
+    chunks and vectors are in memory at once, and early chunks are searchable while later documents
+    are still being chunked.
+    With `hashes` (the previous manifest) only new or changed documents go down the pipeline. Chunks the
+    collection already holds are not re-embedded. Returns ({source: content hash} of every document seen,
+    ids of every chunk produced). Progress is reported per document as it is chunked (or skipped as unchanged),
+    with the number of chunks stored so far.
+    """
+    progress = tqdm(total=count_documents(), unit="doc", desc="Documents")
+    stored = 0
+    documents = asyncio.Queue(QUEUE_SIZE)
+    chunked = asyncio.Queue(QUEUE_SIZE)
+    embedded = asyncio.Queue(QUEUE_SIZE)
+    seen = {}
+    kept = set()
+
+    async def load():
+        iterator = iter_documents()
+        while (document := await asyncio.to_thread(next, iterator, None)) is not None:
+            source = document["source"]
+            seen[source] = document["hash"]
+            if hashes is not None and hashes.get(source) == document["hash"]:
+                progress.update(1)
+                continue
+            await documents.put(document)
+        await documents.put(None)
+
+    async def chunk():
+        scheduler = ChunkingScheduler()
+        slots = asyncio.Semaphore(MAX_CONCURRENCY)  # caps documents held by in-flight chunking tasks
+        tasks = set()
+
+        async def emit(document, results, start):
+            results, removed = remove_near_duplicates(results)
+            # Time from picking the document up to its chunks being ready, including rate limit waits.
+            seconds = time.perf_counter() - start
+            stats.record("create_chunks", document["source"], seconds=seconds, chunks=len(results), duplicates=removed)
+            progress.update(1)
+            await chunked.put(results)
+
+        async def process(document, start):
+            try:
+                await emit(document, await scheduler.chunk(document), start)
+            finally:
+                slots.release()
+
+        while (document := await documents.get()) is not None:
+            start = time.perf_counter()
+            if chunker == "local":
+                await emit(document, chunk_document_locally(document), start)
+                continue
+            cached = load_cached_chunks(document)
+            if cached is not None:
+                stats.record("create_chunks", document["source"], cache_hits=1)
+                await emit(document, cached, start)
+                continue
+            stats.record("create_chunks", document["source"], cache_misses=1)
+            await slots.acquire()
+            task = asyncio.create_task(process(document, start))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        await chunked.put(None)
+
+    async def embed():
+        slots = asyncio.Semaphore(EMBEDDING_WORKERS)
+        tasks = set()
+        batcher = EmbeddingBatcher()
+
+        async def process(batch):
+            try:
+                texts = [chunk.page_content for _, chunk in batch]
+                await embedded.put((batch, await asyncio.to_thread(embed_batch, texts)))
+            finally:
+                slots.release()
+
+        async def dispatch(batch):
+            await slots.acquire()
+            task = asyncio.create_task(process(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        while (results := await chunked.get()) is not None:
+            for item in await asyncio.to_thread(new_items, collection, results, kept):
+                full = batcher.add(item)
+                if full:
+                    await dispatch(full)
+            # Nothing else ready yet: send what we have rather than wait for a full batch.
+            if chunked.empty() and batcher.batch:
+                await dispatch(batcher.flush())
+        if batcher.batch:
+            await dispatch(batcher.flush())
+        await asyncio.gather(*tasks)
+        await embedded.put(None)
+
+    async def write():
+        nonlocal stored
+        while (item := await embedded.get()) is not None:
+            batch, vectors = item
+            await asyncio.to_thread(store_batch, collection, batch, vectors)
+            stored += len(batch)
+            progress.set_postfix(stored=stored)
+
+    async def run(name, stage):
+        start = time.perf_counter()
+        await stage()
+        stats.spans[name] = (start, time.perf_counter())  # the stage's wall time, idle waits included
+
+    names = {"fetch_documents": load, "create_chunks": chunk, "create_embeddings": embed, "store_batch": write}
+    stages = [asyncio.create_task(run(name, stage)) for name, stage in names.items()]
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        for stage in stages:
+            stage.cancel()
+        progress.close()
+    counts = stats.stages.get("create_chunks", Counter())
+    if chunker == "llm":
+        print(f"Chunk cache: {counts['cache_hits']} hits, {counts['cache_misses']} misses")
+    print(f"Near-duplicates removed: {counts['duplicates']} of {counts['chunks'] + counts['duplicates']} chunks")
+    return seen, kept
+
+
+def ingest(incremental=False, chunker="llm", report=None, per_document=False):
+    """
+    Stream the knowledge base into the vector store, optionally only re-processing what changed.
+    With `report`, per-stage statistics (and per-document ones if asked) are written there as JSON.
+    """
+    stats.reset()
+    chroma = PersistentClient(path=DB_NAME)
+    collection, reset = open_collection(chroma)
+    manifest = load_manifest() if incremental and not reset else {}
+    # Without a manifest from the same chunker we can't tell which documents changed: process them all.
+    hashes = manifest["documents"] if manifest.get("chunker") == chunker_id(chunker) else None
+
+    seen, kept = asyncio.run(stream_ingest(collection, chunker, hashes))
+    print(f"Loaded {len(seen)} documents")
+    if hashes is None:
+        removed = remove_stale(collection, kept)
+    else:
+        changed = [source for source, digest in seen.items() if hashes.get(source) != digest]
+        deleted = [source for source in hashes if source not in seen]
+        print(f"{len(changed)} new or changed documents, {len(deleted)} removed")
+        removed = remove_stale(collection, kept, changed + deleted)
+    print(f"{removed} stale chunks removed")
+    print(f"Vectorstore holds {collection.count()} documents")
+    save_manifest(seen, chunker)
+    stats.print_summary()
+    if report:
+        Path(report).write_text(json.dumps(stats.report(per_document), indent=2), encoding="utf-8")
+        print(f"Ingest report written to {report}")
 
 
 if __name__ == "__main__":
-    # Full pipeline: load markdown files -> LLM-chunk them in parallel -> embed and store in Chroma.
-    documents = fetch_documents()
-    chunks = create_chunks(documents)
-    create_embeddings(chunks)
+    # Full pipeline: load markdown files -> chunk them (LLM or local) -> embed and store in Chroma.
+    parser = argparse.ArgumentParser(description="Build the Insurellm vector store from knowledge-base/")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only re-chunk and re-embed files whose content changed since the last run",
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=["llm", "local"],
+        default="llm",
+        help="llm: LLM-labeled chunks (slow, best quality); local: split by markdown headings, no API calls",
+    )
+    parser.add_argument("--report", metavar="PATH", help="write per-stage timings, retries and token usage as JSON")
+    parser.add_argument(
+        "--per-document",
+        action="store_true",
+        help="include a per-document breakdown in the --report",
+    )
+    args = parser.parse_args()
+    ingest(incremental=args.incremental, chunker=args.chunker, report=args.report, per_document=args.per_document)
     print("Ingestion complete")
@@ -0,0 +1,85 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+
+# Okapi BM25 parameters: K1 controls term-frequency saturation, B how strongly scores are normalized by
+# document length.
+K1 = 1.5
+B = 0.75
+RRF_K = 60  # reciprocal rank fusion constant; larger values flatten the weight given to top ranks
+PAGE_SIZE = 1000  # rows read from Chroma per request while building a LexicalIndex
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercased word tokens; keeps acronyms, product names and numbers intact for exact-term matching."""
+    return TOKEN.findall(text.lower())
+
+
+class BM25:
+    """
+    BM25 scorer over a fixed list of documents. Term frequencies are held in an inverted index, so a query
+    only touches the documents that share a term with it.
+    """
+
+    def __init__(self, documents):
+        self.count = len(documents)
+        lengths = np.zeros(self.count)
+        postings = defaultdict(lambda: ([], []))
+        for row, document in enumerate(documents):
+            terms = Counter(tokenize(document))
+            lengths[row] = sum(terms.values())
+            for term, frequency in terms.items():
+                postings[term][0].append(row)
+                postings[term][1].append(frequency)
+        self.postings = {
+            term: (np.array(rows), np.array(frequencies, dtype=np.float64))
+            for term, (rows, frequencies) in postings.items()
+        }
+        average = lengths.mean() if self.count else 0.0
+        self.norms = K1 * (1 - B + B * lengths / max(average, 1.0))
+
+    def scores(self, query):
+        """BM25 score of every document for the query (0 for documents sharing no term with it)."""
+        scores = np.zeros(self.count)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, frequencies = self.postings[term]
+            idf = np.log(1 + (self.count - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * frequencies * (K1 + 1) / (frequencies + self.norms[rows])
+        return scores
+
+
+def rank_fusion(rankings, k=RRF_K):
+    """Reciprocal rank fusion: merge several rankings (lists of keys, best first) into one list of keys."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] += 1 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+class LexicalIndex:
+    """BM25 over every chunk in a Chroma collection, with the ids, documents and metadata to return as results."""
+
+    def __init__(self, collection):
+        self.ids, self.documents, self.metadatas = [], [], []
+        for offset in range(0, collection.count(), PAGE_SIZE):
+            page = collection.get(include=["documents", "metadatas"], limit=PAGE_SIZE, offset=offset)
+            self.ids += page["ids"]
+            self.documents += page["documents"]
+            self.metadatas += page["metadatas"]
+        self.bm25 = BM25(self.documents)
+
+    def search(self, query, k):
+        """Rows of the k best-scoring chunks, best first; chunks sharing no term with the query are left out."""
+        scores = self.bm25.scores(query)
+        k = min(k, self.bm25.count)
+        if k == 0:
+            return []
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [int(row) for row in rows if scores[row] > 0]
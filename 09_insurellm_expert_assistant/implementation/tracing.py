@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+
+# Every finished trace is appended to TRACE_PATH as one JSON line (set it to None to keep traces in memory only).
+TRACE_PATH = Path(__file__).parent.parent / "traces.jsonl"
+
+_trace = ContextVar("trace", default=None)
+_span = ContextVar("span", default=None)
+_write_lock = threading.Lock()
+
+
+class Trace:
+    """
+    Timings of one request through the pipeline: a span per stage, with its duration and any token usage
+    and retries recorded against it. Spans may be added from several threads.
+    """
+
+    def __init__(self, name, **attributes):
+        self.record = {"trace_id": uuid.uuid4().hex, "name": name, "start": time.time(), **attributes}
+        self.spans = []
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Make this the current trace, so that span() calls in this context are recorded in it."""
+        token = _trace.set(self)
+        try:
+            yield self
+        finally:
+            _trace.reset(token)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a stage of this trace; the yielded dict collects usage and other attributes. Unlike the module's
+        span(), this doesn't change the current span, so it may stay open across a generator's yields.
+        """
+        record = {"name": name, **attributes}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["offset"] = round(start - self.started, 4)
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            with self.lock:
+                self.spans.append(record)
+
+    def finish(self):
+        """Close the trace and append it to TRACE_PATH."""
+        self.record["seconds"] = round(time.perf_counter() - self.started, 4)
+        self.record["spans"] = sorted(self.spans, key=lambda span: span["offset"])
+        if TRACE_PATH is not None:
+            with _write_lock, open(TRACE_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.record) + "\n")
+
+    def breakdown(self):
+        """The spans as a markdown table, for display in the UI."""
+        lines = ["| Stage | Start | Seconds | Tokens | Retries |", "|---|---:|---:|---:|---:|"]
+        for span in sorted(self.spans, key=lambda span: span["offset"]):
+            tokens = span.get("prompt_tokens", 0) + span.get("completion_tokens", 0)
+            lines.append(
+                f"| {span['name']} | {span['offset']:.2f} | {span['seconds']:.2f} | {tokens or ''} | {span.get('retries', '')} |"
+            )
+        total = self.record.get("seconds", time.perf_counter() - self.started)
+        return "\n".join(lines + [f"| **total** | | **{total:.2f}** | | |"])
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Trace a request: spans recorded in this context (and in threads given a copy of it) land in one Trace."""
+    current = Trace(name, **attributes)
+    try:
+        with current.activate():
+            yield current
+    finally:
+        current.finish()
+
+
+@asynccontextmanager
+async def atrace(name, **attributes):
+    """Async trace: the finished trace is written from a worker thread, off the event loop."""
+    current = Trace(name, **attributes)
+    try:
+        with current.activate():
+            yield current
+    finally:
+        await asyncio.to_thread(current.finish)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a stage within the current trace; a plain dict is yielded (and dropped) when nothing is being traced."""
+    current = _trace.get()
+    if current is None:
+        yield {}
+        return
+    with current.span(name, **attributes) as record:
+        token = _span.set(record)
+        try:
+            yield record
+        finally:
+            _span.reset(token)
+
+
+def add_usage(response, record=None):
+    """Add an LLM or embedding response's token usage to `record`, by default the current span."""
+    record = record if record is not None else _span.get()
+    usage = getattr(response, "usage", None)
+    if record is None or usage is None:
+        return
+    for field in ["prompt_tokens", "completion_tokens"]:
+        record[field] = record.get(field, 0) + (getattr(usage, field, 0) or 0)
+
+
+def count_retry(retry_state):
+    """tenacity before_sleep hook: count the retry against the current span, or the trace outside any span."""
+    record = _span.get()
+    if record is None and _trace.get() is not None:
+        record = _trace.get().record
+    if record is not None:
+        record["retries"] = record.get("retries", 0) + 1
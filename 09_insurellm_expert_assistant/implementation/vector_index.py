@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+
+# In-process copy of the Chroma collection's vectors, stored next to it in preprocessed_db/.
+# The full-precision vectors form one contiguous memory-mapped float32 matrix, searched exactly by the
+# "exact" mode. Compressed variants give a faster approximate first stage, whose shortlist is rescored
+# against the full vectors (only the rows touched are read).
+# Each build is written to its own directory and published by atomically replacing the CURRENT file that
+# names it, so processes and threads that have the previous build memory-mapped keep reading intact files.
+INDEX_PATH = Path(__file__).parent.parent / "preprocessed_db" / "vector_index"
+TRUNCATE_DIMS = 256  # text-embedding-3 models are Matryoshka-trained, so a prefix is a usable embedding
+SHORTLIST_K = 100  # candidates from the first stage that are rescored at full precision
+INT8_BLOCK_ROWS = 64  # int8 rows widened to float32 at a time when scoring; small enough to stay in cache
+MODES = ["truncate", "int8", "binary"]
+PAGE_SIZE = 1000  # rows read from Chroma per request while exporting
+
+
+def fingerprint(ids):
+    """Identify the collection's contents: chunk ids are content hashes, so the sorted ids change with any edit."""
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+
+def normalize(vectors):
+    """Scale rows to unit length so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def current_build(path=INDEX_PATH):
+    """The directory of the published build, or None if nothing has been built yet."""
+    pointer = path / "CURRENT"
+    return path / pointer.read_text(encoding="utf-8").strip() if pointer.exists() else None
+
+
+def publish(build, path=INDEX_PATH):
+    """
+    Make `build` the current index with an atomic rename, then delete older builds. The build it replaces is
+    kept, since other readers may still be opening it; files already memory-mapped survive deletion.
+    """
+    previous = current_build(path)
+    pointer = path / f"CURRENT.{build.name}"
+    pointer.write_text(build.name, encoding="utf-8")
+    os.replace(pointer, path / "CURRENT")
+    for old in path.glob("build-*"):
+        if old not in (build, previous):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def build_index(collection, path=INDEX_PATH):
+    """
+    Export the collection's vectors, documents and metadata, and write every compressed variant into a new
+    build directory; publish it once it's complete. Returns the new build, opened before it's published so
+    that no other process can have deleted it yet.
+    """
+    staging = path / f"staging-{uuid.uuid4().hex}"
+    staging.mkdir(parents=True)
+    total = collection.count()
+    ids, documents, metadatas = [], [], []
+    vectors = None
+    for offset in range(0, total, PAGE_SIZE):
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=PAGE_SIZE, offset=offset
+        )
+        embeddings = normalize(np.asarray(page["embeddings"], dtype=np.float32))
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                staging / "full.npy", mode="w+", dtype=np.float32, shape=(total, embeddings.shape[1])
+            )
+        vectors[offset : offset + len(embeddings)] = embeddings
+        ids += page["ids"]
+        documents += page["documents"]
+        metadatas += page["metadatas"]
+    if vectors is None:
+        shutil.rmtree(staging)
+        raise ValueError("The collection is empty; run implementation/ingest.py first")
+    vectors.flush()
+
+    # Compressed variants. int8 uses one symmetric scale per dimension, taken from the corpus.
+    np.save(staging / "truncate.npy", normalize(vectors[:, :TRUNCATE_DIMS]))
+    scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127
+    np.save(staging / "int8.npy", np.round(vectors / scale).astype(np.int8))
+    np.save(staging / "int8_scale.npy", scale.astype(np.float32))
+    np.save(staging / "binary.npy", np.packbits(vectors > 0, axis=1))
+    del vectors  # close the memory map before renaming the directory
+
+    chunks = {"fingerprint": fingerprint(ids), "ids": ids, "documents": documents, "metadatas": metadatas}
+    (staging / "chunks.json").write_text(json.dumps(chunks), encoding="utf-8")
+    index = VectorIndex(staging)
+    build = path / staging.name.replace("staging-", "build-")
+    staging.rename(build)
+    publish(build, path)
+    print(f"Vector index built with {total} vectors")
+    return index
+
+
+def top_k(scores, k):
+    """Row indices of the k highest scores per query, best first, without a full sort."""
+    k = min(k, scores.shape[1])
+    rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, rows, axis=1), axis=1)
+    return np.take_along_axis(rows, order, axis=1)
+
+
+class VectorIndex:
+    """One build of the on-disk index, memory-mapped. Queries are matched by cosine similarity, like the Chroma search."""
+
+    def __init__(self, path):
+        chunks = json.loads((path / "chunks.json").read_text(encoding="utf-8"))
+        self.fingerprint = chunks["fingerprint"]
+        self.ids = chunks["ids"]
+        self.rows = {id: row for row, id in enumerate(self.ids)}
+        self.documents = chunks["documents"]
+        self.metadatas = chunks["metadatas"]
+        self.full = np.load(path / "full.npy", mmap_mode="r")
+        self.compressed = {mode: np.load(path / f"{mode}.npy", mmap_mode="r") for mode in MODES}
+        self.int8_scale = np.load(path / "int8_scale.npy")
+
+    def vectors(self, ids):
+        """Unit-length vectors of the chunks with these ids, in order, or None if any isn't in this build."""
+        if any(id not in self.rows for id in ids):
+            return None
+        return np.asarray(self.full[[self.rows[id] for id in ids]])
+
+    def first_stage(self, queries, mode):
+        """Approximate similarity of every stored vector to each query, using a compressed variant."""
+        if mode == "truncate":
+            return normalize(queries[:, :TRUNCATE_DIMS]) @ self.compressed["truncate"].T
+        if mode == "int8":
+            return self.int8_scores(queries * self.int8_scale)
+        if mode == "binary":
+            # Negated Hamming distance between sign bits.
+            bits = np.packbits(queries > 0, axis=1)
+            stored = self.compressed["binary"]
+            return np.stack([-np.bitwise_count(row ^ stored).sum(axis=1, dtype=np.int32) for row in bits])
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    def int8_scores(self, queries):
+        """
+        queries @ int8.T without a float32 copy of the matrix: INT8_BLOCK_ROWS rows at a time are widened
+        into one reused buffer, so only the int8 bytes are read from memory.
+        """
+        stored = self.compressed["int8"]
+        scores = np.empty((len(stored), len(queries)), dtype=np.float32)
+        block = np.empty((INT8_BLOCK_ROWS, stored.shape[1]), dtype=np.float32)
+        queries = np.ascontiguousarray(queries.T, dtype=np.float32)
+        for start in range(0, len(stored), INT8_BLOCK_ROWS):
+            rows = stored[start : start + INT8_BLOCK_ROWS]
+            np.copyto(block[: len(rows)], rows, casting="unsafe")
+            np.matmul(block[: len(rows)], queries, out=scores[start : start + len(rows)])
+        return scores.T
+
+    def search(self, queries, k, mode, shortlist=SHORTLIST_K):
+        """
+        Return the rows of the k nearest vectors for each query (a 2-D array of embeddings).
+        "exact" scores every full-precision vector with one matrix product. Otherwise the compressed first stage
+        picks `shortlist` candidates per query, which are rescored at full precision;
+        shortlist=None returns the first-stage ranking as is.
+        """
+        queries = normalize(np.asarray(queries, dtype=np.float32))
+        if mode == "exact":
+            return top_k(queries @ self.full.T, k)
+        candidates = top_k(self.first_stage(queries, mode), shortlist or k)
+        if shortlist is None:
+            return candidates
+        candidates = np.sort(candidates, axis=1)  # read the memory-mapped rows in file order
+        rescored = np.einsum("qd,qcd->qc", queries, self.full[candidates])
+        return np.take_along_axis(candidates, top_k(rescored, k), axis=1)
+
+
+def load_index(collection, path=INDEX_PATH):
+    """Load the current build, (re)building the index first if it's missing or the collection has changed since."""
+    current = fingerprint(collection.get(include=[])["ids"])
+    build = current_build(path)
+    try:
+        index = VectorIndex(build) if build is not None else None
+    except FileNotFoundError:
+        index = None  # replaced and cleaned up by another process between reading CURRENT and opening it
+    if index is not None and index.fingerprint == current:
+        return index
+    return build_index(collection, path)
+
+
+def report_recall(index, k):
+    """
+    Print recall@k of each compressed mode against exact full-precision search on the evaluation questions,
+    and each mode's latency searching one question at a time, as the answer pipeline does.
+    """
+    from evaluation.test import load_tests
+    from implementation.answer import embedding_model, openai
+
+    questions = [test.question for test in load_tests()]
+    data = openai.embeddings.create(model=embedding_model, input=questions).data
+    queries = normalize(np.asarray([e.embedding for e in data], dtype=np.float32))
+    exact = index.search(queries, k, "exact")
+
+    def latency(mode):
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query[None], k, mode)
+        return (time.perf_counter() - start) / len(questions) * 1000
+
+    def recall(rows):
+        return np.mean([len(set(found) & set(truth)) / len(truth) for found, truth in zip(rows, exact)])
+
+    print(f"Recall@{k} vs full precision over {len(questions)} questions:")
+    for mode in MODES:
+        size = index.compressed[mode].nbytes / 2**20
+        first_stage = recall(index.search(queries, k, mode, shortlist=None))
+        two_stage = recall(index.search(queries, k, mode))
+        print(
+            f"  {mode:<8} {size:7.1f} MB  first stage {first_stage:.3f}  "
+            f"rescored top {SHORTLIST_K} {two_stage:.3f}  {latency(mode):.2f} ms/query"
+        )
+    print(f"  exact    {index.full.nbytes / 2**20:7.1f} MB  {'':>36}{latency('exact'):.2f} ms/query")
+
+
+def main():
+    """CLI: rebuild the index from the Chroma collection, optionally reporting recall per mode."""
+    from implementation.answer import RETRIEVAL_K, collection
+
+    parser = argparse.ArgumentParser(description="Build the compressed vector index from the Chroma collection")
+    parser.add_argument(
+        "--recall",
+        action="store_true",
+        help="report recall against full precision on evaluation/tests.jsonl",
+    )
+    args = parser.parse_args()
+    index = build_index(collection)
+    if args.recall:
+        report_recall(index, RETRIEVAL_K)
+
+
+if __name__ == "__main__":
+    main()
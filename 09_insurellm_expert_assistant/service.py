@@ -0,0 +1,217 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import numpy as np
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from implementation import answer, async_answer
+
+load_dotenv(override=True)
+
+# HTTP access to the assistant for other tools; run several instances behind a load balancer to scale out.
+# Requests beyond MAX_IN_FLIGHT (answering, streaming or retrieving at once) are rejected with 429 rather
+# than queued, so the load balancer can send them elsewhere.
+MAX_IN_FLIGHT = 64
+RETRY_AFTER = 1  # seconds, suggested to rejected clients
+WARMUP_QUESTION = "What does Insurellm do?"  # answered once at startup to load indexes and clients; None skips
+LATENCY_WINDOW = 1000  # recent requests per endpoint used for the latency percentiles
+
+
+class Question(BaseModel):
+    """A question to the assistant, with the conversation so far."""
+
+    question: str
+    history: list[dict] = []
+
+
+class Metrics:
+    """Request counters and recent latencies per endpoint, plus the number of requests in flight."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counts = {}
+        self.latencies = {}
+
+    def admit(self, endpoint):
+        """Count a request in, or raise 429 if MAX_IN_FLIGHT are already being served."""
+        with self.lock:
+            if self.in_flight >= MAX_IN_FLIGHT:
+                self.count(endpoint, "rejected")
+                raise HTTPException(429, "Too many requests in flight", headers={"Retry-After": str(RETRY_AFTER)})
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def release(self, endpoint, start, outcome):
+        """Count a request out, recording its outcome ("ok", "error" or "rejected") and latency."""
+        with self.lock:
+            self.in_flight -= 1
+            self.count(endpoint, outcome)
+            window = self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW))
+            window.append(time.perf_counter() - start)
+
+    def count(self, endpoint, outcome):
+        """Increment an outcome counter; the caller holds the lock."""
+        counts = self.counts.setdefault(endpoint, {"ok": 0, "error": 0, "rejected": 0})
+        counts[outcome] += 1
+
+    def report(self):
+        """In-flight requests and, per endpoint, outcome counts and p50/p95/p99 latency."""
+        with self.lock:
+            endpoints = {}
+            for endpoint, counts in self.counts.items():
+                window = list(self.latencies.get(endpoint, []))
+                percentiles = np.percentile(window, [50, 95, 99]).round(4).tolist() if window else [None] * 3
+                endpoints[endpoint] = {**counts, **dict(zip(["p50_seconds", "p95_seconds", "p99_seconds"], percentiles))}
+            return {"in_flight": self.in_flight, "max_in_flight": MAX_IN_FLIGHT, "endpoints": endpoints}
+
+
+metrics = Metrics()
+
+
+@asynccontextmanager
+async def served(endpoint):
+    """Admit a request (or reject it with 429) and record its outcome and latency."""
+    start = metrics.admit(endpoint)
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except async_answer.Overloaded:
+        outcome = "rejected"
+        raise HTTPException(429, "Answer queue is full", headers={"Retry-After": str(RETRY_AFTER)})
+    finally:
+        metrics.release(endpoint, start, outcome)
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """A StreamingResponse that awaits `release` once it's over: finished, failed, or the client went away."""
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.release()
+
+
+def chunk_json(chunk):
+    """A retrieved chunk as a JSON-serializable dict."""
+    return chunk.model_dump()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Open the collection and load the search indexes once, then warm the whole pipeline with one question."""
+    print(f"Collection holds {answer.collection.count()} chunks")
+    answer.load_indexes()
+    if WARMUP_QUESTION:
+        start = time.perf_counter()
+        await async_answer.aanswer_question(WARMUP_QUESTION)
+        print(f"Warmed up in {time.perf_counter() - start:.2f}s")
+    yield
+
+
+app = FastAPI(title="Insurellm Expert Assistant", lifespan=lifespan)
+
+
+@app.post("/answer")
+async def answer_endpoint(request: Question):
+    """Answer a question: the answer text and the chunks it was grounded in."""
+    async with served("answer"):
+        text, chunks = await async_answer.aanswer_question(request.question, request.history)
+    return {"answer": text, "chunks": [chunk_json(chunk) for chunk in chunks]}
+
+
+@app.post("/retrieve")
+async def retrieve_endpoint(request: Question):
+    """Only the retrieval pipeline: the chunks that would be used to answer the question."""
+    async with served("retrieve"):
+        async with async_answer.admitted():
+            chunks = await async_answer.afetch_context(request.question)
+    return {"chunks": [chunk_json(chunk) for chunk in chunks]}
+
+
+@app.post("/answer/stream")
+async def stream_endpoint(request: Question):
+    """
+    Stream an answer as newline-delimited JSON: first {"chunks": [...]} once retrieval finishes, then
+    {"delta": "..."} for each piece of the answer as it arrives. The answer slot is taken before the response
+    starts, so a full queue is rejected with 429 like the other endpoints.
+    """
+    start = metrics.admit("stream")
+    slot = AsyncExitStack()
+    try:
+        await slot.enter_async_context(async_answer.admitted())
+    except async_answer.Overloaded:
+        metrics.release("stream", start, "rejected")
+        raise HTTPException(429, "Answer queue is full", headers={"Retry-After": str(RETRY_AFTER)})
+    outcome = "error"  # until the whole answer has been sent
+
+    async def lines():
+        nonlocal outcome
+        sent = None
+        async for text, chunks in async_answer.astream_answer(request.question, request.history, admit=False):
+            if sent is None:  # first yield: retrieval is done (or a cached answer arrived whole)
+                yield json.dumps({"chunks": [chunk_json(chunk) for chunk in chunks]}) + "\n"
+                sent = ""
+            if text:
+                yield json.dumps({"delta": text[len(sent) :]}) + "\n"
+                sent = text
+        outcome = "ok"
+
+    async def release():
+        await slot.aclose()
+        metrics.release("stream", start, outcome)
+
+    return ReleasingStreamingResponse(lines(), release, media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Request counts, latency percentiles and in-flight requests, with the pipeline's cache and fast-path stats."""
+    return {
+        **metrics.report(),
+        "caches": answer.cache_stats(),
+        "prompts": answer.prompt_stats(),
+        "fast_path": answer.fast_path_stats(),
+    }
+
+
+@app.get("/health")
+async def health():
+    """Liveness check for the load balancer."""
+    return {"status": "ok"}
+
+
+def main():
+    """CLI: serve the assistant over HTTP, optionally with the offline fake LLM for load testing."""
+    parser = argparse.ArgumentParser(description="Serve the Insurellm assistant over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--fake-llm",
+        action="store_true",
+        help="answer with an offline stand-in for the LLM and embedding APIs (see implementation/fake_llm.py)",
+    )
+    args = parser.parse_args()
+    if args.fake_llm:
+        from implementation import fake_llm
+
+        fake_llm.install()
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()